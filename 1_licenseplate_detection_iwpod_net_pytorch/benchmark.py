@@ -0,0 +1,335 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+import torch
+
+import detect
+import src.preprocessing
+from detect import detect_lp_width, detect_lp_width_batch, detection_pipeline, vtype_parameters
+from src.backends import BACKENDS, load_backend
+from src.preprocessing import Preprocessor
+from src.profiling import StageTimer, latency_summary
+from src.rectify import Rectifier
+from src.utils import im2single, image_files_from_folder
+
+#
+#  Detection benchmark: runs the detection code of detect.py over image folders and synthetic images
+#  for every combination of vtype, input width, threshold, batch size and thread count, and reports
+#  latency percentiles of each stage (JPEG decoding, resize, network, output map decoding, NMS and
+#  plate rectification) and images/s. Batches of one image go through detect_lp_width (detect.py -i),
+#  larger batches through detect_lp_width_batch (grouped by input size as in serve.py), and with
+#  --pipeline, image files through detection_pipeline (detect.py -d). Stages are timed per image;
+#  forward is the time of a forward pass divided by its batch size (forward_pass: per pass). Results
+#  are written as JSON, and --compare checks them against the results of a previous run (e.g. from
+#  another commit) to catch regressions
+#
+STAGES = ['imdecode', 'resize', 'forward', 'decode_map', 'nms', 'rectify']
+
+
+def load_images(folder, max_images=0):
+    #
+    #  Encoded bytes of the images of a folder, so that disk reads are not timed
+    #
+    files = sorted(image_files_from_folder(folder))
+    if max_images > 0:
+        files = files[:max_images]
+    images = []
+    for file in files:
+        with open(file, 'rb') as fp:
+            images.append(fp.read())
+    return images
+
+
+def synthetic_images(w, h, count, seed=0):
+    #
+    #  Smooth random images (JPEG encoded), with the cost of decoding and resizing real photos
+    #
+    rng = np.random.RandomState(seed)
+    images = []
+    for _ in range(count):
+        I = rng.randint(0, 256, (max(1, h // 16), max(1, w // 16), 3)).astype(np.uint8)
+        I = cv2.resize(I, (w, h), interpolation=cv2.INTER_LINEAR)
+        images.append(cv2.imencode('.jpg', I, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes())
+    return images
+
+
+class TimedModel:
+    #
+    #  Backend timing its forward passes (waiting for the device): once per pass as stage forward_pass,
+    #  and divided by the batch size once per image as stage forward
+    #
+    def __init__(self, model, timer):
+        self.model = model
+        self.timer = timer
+        self.device = model.device
+
+    def eval(self):
+        return self
+
+    def __call__(self, inputs):
+        start = time.perf_counter()
+        outputs = self.model(inputs)
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize()
+        elapsed = time.perf_counter() - start
+        self.timer.add('forward_pass', elapsed)
+        for _ in range(len(inputs)):
+            self.timer.add('forward', elapsed / len(inputs))
+        return outputs
+
+
+class TimedCv2:
+    #
+    #  cv2 module as seen by detect.py and src.preprocessing, timing image reads and resizes
+    #
+    def __init__(self, timer):
+        self.imread = timer.wrap('imdecode', cv2.imread)
+        self.resize = timer.wrap('resize', cv2.resize)
+
+    def __getattr__(self, name):
+        return getattr(cv2, name)
+
+
+@contextmanager
+def instrumented(timer):
+    #
+    #  Times the calls of the functions detect.py uses for each stage by replacing them in the modules
+    #  calling them (in this process only)
+    #
+    patches = [(detect, 'cv2', TimedCv2(timer)), (src.preprocessing, 'cv2', TimedCv2(timer)),
+               (detect, 'decode_output_map', timer.wrap('decode_map', detect.decode_output_map)),
+               (detect, 'nms_boxes', timer.wrap('nms', detect.nms_boxes)),
+               (detect, 'rectify_plates', timer.wrap('rectify', detect.rectify_plates))]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    for module, name, fn in patches:
+        setattr(module, name, fn)
+    try:
+        yield
+    finally:
+        for module, name, fn in originals:
+            setattr(module, name, fn)
+
+
+def detect_images(model, Is, vtype, width, threshold, bucket_step, timer, preprocessor, rectifiers, ocr_input_size=(80, 240)):
+    #
+    #  Detects plates in decoded images: a single image (uint8) with detect_lp_width, as detect.py -i,
+    #  and several (float, im2single) with detect_lp_width_batch, grouped by network input width and
+    #  plate size as serve.py does. Returns the number of detected plates
+    #
+    net_step = 2 ** 4
+    if len(Is) == 1:
+        MAXWIDTH, out_size = vtype_parameters(vtype, Is[0], ocr_input_size)
+        if out_size not in rectifiers:
+            rectifiers[out_size] = Rectifier(out_size)
+        L, _, _ = detect_lp_width(model, Is[0], width or MAXWIDTH, net_step, out_size, threshold, model.device, preprocessor,
+                                  timer.wrap('rectify', rectifiers[out_size]))
+        return len(L)
+
+    groups = {}
+    for I in Is:
+        MAXWIDTH, out_size = vtype_parameters(vtype, I, ocr_input_size)
+        groups.setdefault((width or MAXWIDTH, out_size), []).append(I)
+    detections = 0
+    for (MAXWIDTH, out_size), group in groups.items():
+        Ls, _, _ = detect_lp_width_batch(model, group, MAXWIDTH, net_step, out_size, threshold, bucket_step, model.device)
+        detections += sum(len(L) for L in Ls)
+    return detections
+
+
+def run_config(model, images, vtype, width, threshold, batch_size, bucket_step=64, repeats=1):
+    preprocessor = Preprocessor(model.device)
+    rectifiers = {}
+
+    def run_batch(batch, timer):
+        Is = []
+        for data in batch:
+            with timer.stage('imdecode'):
+                I = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                Is.append(I if len(batch) == 1 else im2single(I))
+        with instrumented(timer):
+            return detect_images(TimedModel(model, timer), Is, vtype, width, threshold, bucket_step, timer, preprocessor, rectifiers)
+
+    run_batch(images[:batch_size], StageTimer())  # warm-up
+
+    timer = StageTimer()
+    latencies = []
+    detections = 0
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for b in range(0, len(images), batch_size):
+            batch = images[b:b + batch_size]
+            batch_start = time.perf_counter()
+            detections += run_batch(batch, timer)
+            latencies += [time.perf_counter() - batch_start] * len(batch)  # results of a batch are ready together
+    elapsed = time.perf_counter() - start
+
+    stages = timer.summary()
+    stages['image'] = latency_summary(latencies)
+    return {'images_per_sec': len(latencies) / elapsed, 'detections': detections, 'stages': stages}
+
+
+def run_pipeline(model, paths, vtype, threshold, decode_workers=4, post_workers=2, repeats=1):
+    #
+    #  detection_pipeline over image files, as detect.py -d. The latency of an image runs from the start
+    #  of its decoding to the end of its postprocessing, waits in the queues included
+    #
+    def run(paths, timer):
+        pipeline = detection_pipeline(TimedModel(model, timer), vtype, threshold, decode_workers=decode_workers,
+                                      post_workers=post_workers)
+        with instrumented(timer):
+            return list(pipeline.run(paths))
+
+    run(paths[:1], StageTimer())  # warm-up
+
+    timer = StageTimer()
+    start = time.perf_counter()
+    items = run(paths * repeats, timer)
+    elapsed = time.perf_counter() - start
+
+    stages = timer.summary()
+    stages['image'] = latency_summary([item['time'] for item in items])
+    return {'images_per_sec': len(items) / elapsed, 'detections': sum(len(item['labels']) for item in items), 'stages': stages}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return tuple(result.get(key) for key in ('dataset', 'mode', 'vtype', 'width', 'threshold', 'batch_size', 'threads'))
+
+
+def config_name(result):
+    return '%s %s %s w=%s t=%g b=%s j=%d' % (result['dataset'], result['mode'], result['vtype'], result['width'] or 'auto',
+                                            result['threshold'], result['batch_size'] or '-', result['threads'])
+
+
+def compare(results, baseline, tolerance):
+    #
+    #  Prints changes of p50 latency and throughput with respect to the matching configurations of a
+    #  baseline run, and returns the number of regressions (slower than the baseline by more than
+    #  tolerance, relative)
+    #
+    previous = {result_key(result): result for result in baseline['results']}
+    regressions = 0
+    print('\nCompared to %s (commit %s):' % (baseline['meta'].get('date'), baseline['meta'].get('commit')))
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        p50, old_p50 = result['stages']['image']['p50_ms'], old['stages']['image']['p50_ms']
+        latency_change = p50 / max(old_p50, 1e-9) - 1
+        throughput_change = result['images_per_sec'] / max(old['images_per_sec'], 1e-9) - 1
+        regression = latency_change > tolerance or throughput_change < -tolerance
+        regressions += regression
+        print('%-60s p50 %8.2f -> %8.2f ms (%+6.1f%%)  %7.2f -> %7.2f images/s (%+6.1f%%)%s' % (
+            config_name(result), old_p50, p50, 100 * latency_change, old['images_per_sec'], result['images_per_sec'],
+            100 * throughput_change, '  REGRESSION' if regression else ''))
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--image-dirs', type=str, nargs='*', default=['images', 'train_dir'], help='Image folders to benchmark')
+    parser.add_argument('--synthetic', type=str, nargs='*', default=['1280x720', '1920x1080'], help='Sizes (WxH) of synthetic image sets')
+    parser.add_argument('--synthetic-count', type=int, default=8, help='Images in each synthetic set')
+    parser.add_argument('-n', '--max-images', type=int, default=16, help='Images used from each folder (0 = all)')
+    parser.add_argument('-r', '--repeats', type=int, default=1, help='Passes over each image set')
+    parser.add_argument('-v', '--vtypes', type=str, nargs='*', default=['fullimage', 'car'], help='Image types (car, truck, bus, bike or fullimage)')
+    parser.add_argument('-w', '--widths', type=int, nargs='*', default=[0], help='Maximum network input widths (0 = the vtype default)')
+    parser.add_argument('-t', '--thresholds', type=float, nargs='*', default=[0.35], help='Detection thresholds')
+    parser.add_argument('--batch-sizes', type=int, nargs='*', default=[1, 4], help='Batch sizes')
+    parser.add_argument('--bucket-step', type=int, default=64, help='Batches: inputs are zero-padded to multiples of this size (multiple of 16), so that images of similar sizes share a forward pass')
+    parser.add_argument('--pipeline', action='store_true', help='Also runs the threaded pipeline of detect.py -d on each image set')
+    parser.add_argument('--decode-workers', type=int, default=4, help='Pipeline: threads decoding and resizing images')
+    parser.add_argument('--post-workers', type=int, default=2, help='Pipeline: threads running NMS and plate rectification')
+    parser.add_argument('-j', '--threads', type=int, nargs='*', default=[torch.get_num_threads()], help='Numbers of PyTorch and OpenCV threads')
+    parser.add_argument('-b', '--backend', type=str, default='eager', choices=BACKENDS, help='Inference backend')
+    parser.add_argument('-m', '--model', type=str, default='weights/iwpodnet_retrained_epoch10000.pth', help='Model checkpoint (eager) or exported model')
+    parser.add_argument('--no-fuse', action='store_true', help='Keeps BatchNorm layers separate instead of folding them into the convolutions')
+    parser.add_argument('-o', '--output', type=str, default='benchmark.json', help='Results file (JSON)')
+    parser.add_argument('--compare', type=str, default=None, help='Results file of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=.1, help='Relative slowdown reported as a regression by --compare')
+    args = parser.parse_args()
+
+    datasets = []
+    for folder in args.image_dirs:
+        if os.path.isdir(folder):
+            datasets.append((os.path.basename(os.path.normpath(folder)), load_images(folder, args.max_images)))
+        else:
+            print('Skipping missing folder %s' % folder)
+    for size in args.synthetic:
+        w, h = [int(v) for v in size.lower().split('x')]
+        datasets.append(('synthetic_%dx%d' % (w, h), synthetic_images(w, h, args.synthetic_count)))
+    datasets = [(name, images) for name, images in datasets if len(images)]
+
+    model = load_backend(args.backend, args.model, fuse=not args.no_fuse)
+    meta = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': git_commit(), 'backend': args.backend, 'model': args.model,
+            'device': str(model.device), 'torch': torch.__version__, 'opencv': cv2.__version__, 'python': platform.python_version(),
+            'machine': platform.machine(), 'processor': platform.processor(), 'cpu_count': os.cpu_count(), 'repeats': args.repeats}
+
+    #
+    #  The pipeline reads image files: the image sets are written to a temporary folder
+    #
+    files_dir = tempfile.TemporaryDirectory() if args.pipeline else None
+    paths = {}
+    if files_dir is not None:
+        for name, images in datasets:
+            os.makedirs(os.path.join(files_dir.name, name))
+            paths[name] = [os.path.join(files_dir.name, name, '%05d.jpg' % i) for i in range(len(images))]
+            for path, data in zip(paths[name], images):
+                with open(path, 'wb') as fp:
+                    fp.write(data)
+
+    results = []
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        cv2.setNumThreads(threads)
+        for name, images in datasets:
+            for vtype in args.vtypes:
+                for threshold in args.thresholds:
+                    configs = [(width, batch_size) for width in args.widths for batch_size in args.batch_sizes]
+                    if args.pipeline:
+                        configs.append((0, None))
+                    for width, batch_size in configs:
+                        result = {'dataset': name, 'images': len(images), 'vtype': vtype, 'width': width or None, 'threshold': threshold,
+                                  'batch_size': batch_size, 'threads': threads}
+                        if batch_size is None:
+                            result['mode'] = 'pipeline'
+                            result.update(run_pipeline(model, paths[name], vtype, threshold, args.decode_workers, args.post_workers,
+                                                       args.repeats))
+                        else:
+                            result['mode'] = 'single' if batch_size == 1 else 'batch'
+                            result.update(run_config(model, images, vtype, width, threshold, batch_size, args.bucket_step, args.repeats))
+                        results.append(result)
+                        stages = result['stages']
+                        print('%-60s %7.2f images/s  image p50 %8.2f p95 %8.2f p99 %8.2f ms  |  %s' % (
+                            config_name(result), result['images_per_sec'], stages['image']['p50_ms'], stages['image']['p95_ms'],
+                            stages['image']['p99_ms'], '  '.join('%s %.2f' % (stage, stages[stage]['p50_ms']) if stage in stages
+                                                                 else '%s -' % stage for stage in STAGES)))
+    if files_dir is not None:
+        files_dir.cleanup()
+
+    with open(args.output, 'w') as fp:
+        json.dump({'meta': meta, 'results': results}, fp, indent=1, sort_keys=True)
+    print('Results written to %s' % args.output)
+
+    if args.compare is not None:
+        with open(args.compare) as fp:
+            regressions = compare(results, json.load(fp), args.tolerance)
+        print('%d regressions' % regressions)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,70 @@
+import argparse
+import base64
+import http.client
+import json
+import os
+from urllib.parse import urlencode
+
+
+class DetectionClient:
+    #
+    #  Client of serve.py. A connection is kept open (HTTP/1.1 keep-alive), so each thread should use
+    #  its own client
+    #
+    def __init__(self, host='127.0.0.1', port=8080, timeout=60):
+        self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, method, url, body=None, headers={}):
+        self.connection.request(method, url, body=body, headers=headers)
+        response = self.connection.getresponse()
+        result = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError('%d: %s' % (response.status, result.get('error')))
+        return result
+
+    def detect(self, image_bytes, vtype=None, threshold=None, crops=False):
+        params = {key: value for key, value in (('vtype', vtype), ('threshold', threshold)) if value is not None}
+        params['crops'] = int(crops)
+        return self.request('POST', '/detect?' + urlencode(params), image_bytes, {'Content-Type': 'application/octet-stream'})
+
+    def detect_path(self, path, vtype=None, threshold=None, crops=False):
+        # the image is read by the server
+        request = {key: value for key, value in (('path', os.path.abspath(path)), ('vtype', vtype), ('threshold', threshold)) if value is not None}
+        request['crops'] = crops
+        return self.request('POST', '/detect', json.dumps(request), {'Content-Type': 'application/json'})
+
+    def health(self):
+        return self.request('GET', '/health')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('images', type=str, nargs='+', help='Input images')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Server address')
+    parser.add_argument('-p', '--port', type=int, default=8080, help='Server port')
+    parser.add_argument('-v', '--vtype', type=str, default=None, help='Image type (default = the server default)')
+    parser.add_argument('-t', '--lp_threshold', type=float, default=None, help='Detection threshold (default = the server default)')
+    parser.add_argument('--by-path', action='store_true', help='Sends image paths (read by the server, from its --image-root) instead of image bytes')
+    parser.add_argument('-c', '--crops-dir', type=str, default=None, help='Saves rectified plates to this directory')
+    args = parser.parse_args()
+
+    client = DetectionClient(args.host, args.port)
+    crops = args.crops_dir is not None
+    if crops and not os.path.isdir(args.crops_dir):
+        os.makedirs(args.crops_dir)
+
+    for path in args.images:
+        if args.by_path:
+            result = client.detect_path(path, args.vtype, args.lp_threshold, crops)
+        else:
+            with open(path, 'rb') as fp:
+                result = client.detect(fp.read(), args.vtype, args.lp_threshold, crops)
+
+        for i, plate in enumerate(result['plates']):
+            if crops:
+                crop_path = os.path.join(args.crops_dir, '%s_plate%d.png' % (os.path.splitext(os.path.basename(path))[0], i))
+                with open(crop_path, 'wb') as fp:
+                    fp.write(base64.b64decode(plate.pop('crop')))
+                plate['crop'] = crop_path
+        print(json.dumps({'image': path, 'plates': result['plates'], 'latency': result['latency']}))
@@ -1,13 +1,17 @@
 import argparse
+import json
 import os
 import sys
 import time
 
 import torch
-import tkinter as tk
 
 sys.path.append(os.path.dirname(__file__))
 from src.model import IWPODNet
+from src.backends import BACKENDS, load_backend
+from src.pipeline import Failure, Pipeline, Stage
+from src.preprocessing import Preprocessor
+from src.rectify import Rectifier, rectify_plates
 from src.utils import *
 from src.label import *
 from src.projection_utils import *
@@ -21,67 +25,80 @@ class DLabel(Label):
         Label.__init__(self, cl, tl, br, prob)
 
 
-def reconstruct_new(Iorig, I, Y, out_size, threshold=.9):
+def decode_output_map(I, Y, threshold=.9):
+    #
+    #  Decodes every cell of the output map Y with classification probability greater than threshold
+    #  at once. Returns the LP corners as a (N, 2, 4) array, relative to the dimensions of I, and
+    #  a (N,) array with their probabilities
+    #
     net_stride = 2 ** 4
     side = ((208. + 40.) / 2.) / net_stride  # based on rescaling of training data
 
     Probs = Y[0, ...].cpu().numpy()
     Affines = Y[-6:, ...].cpu().numpy()  # gets the last six coordinates related to the Affine transform
-    rx, ry = Y.shape[1:]
 
     #
-    #  Finds cells with classification probability greater than threshold
+    #  Finds cells (row yy, column xx) with classification probability greater than threshold
     #
-    xx, yy = np.where(Probs > threshold)
+    yy, xx = np.where(Probs > threshold)
+    probs = Probs[yy, xx]
     WH = getWH(I.shape)
     MN = WH / net_stride
 
     #
-    #  Warps canonical square to detected LP
+    #  Builds all affine transformation matrices
     #
-    vxx = vyy = 0.5  # alpha -- must match training script
-    base = lambda vx, vy: np.matrix([[-vx, -vy, 1.], [vx, -vy, 1.], [vx, vy, 1.], [-vx, vy, 1.]]).T
-    labels = []
+    A = Affines[:, yy, xx].T.reshape((-1, 2, 3)).astype(float)
+    A[:, 0, 0] = np.maximum(A[:, 0, 0], 0.)
+    A[:, 1, 1] = np.maximum(A[:, 1, 1], 0.)
 
-    for i in range(len(xx)):
-        y, x = xx[i], yy[i]
-        affine = Affines[:, y, x]
-        prob = Probs[y, x]
+    #
+    #  Warps canonical square to detected LPs
+    #
+    vxx = vyy = 0.5  # alpha -- must match training script
+    base = np.array([[-vxx, -vyy, 1.], [vxx, -vyy, 1.], [vxx, vyy, 1.], [-vxx, vyy, 1.]]).T
+    pts = np.matmul(A, base)  # *alpha
+    pts_MN_center_mn = pts * side
+    mn = np.stack((xx + .5, yy + .5), 1)
+    pts_MN = pts_MN_center_mn + mn.reshape((-1, 2, 1))
 
-        mn = np.array([float(x) + .5, float(y) + .5])
+    pts_prop = pts_MN / MN.reshape((1, 2, 1))
+    return pts_prop, probs
 
-        #
-        #  Builds affine transformatin matrix
-        #
-        A = np.reshape(affine, (2, 3))
-        A[0, 0] = max(A[0, 0], 0.)
-        A[1, 1] = max(A[1, 1], 0.)
 
-        pts = np.array(A * base(vxx, vyy))  # *alpha
-        pts_MN_center_mn = pts * side
-        pts_MN = pts_MN_center_mn + mn.reshape((2, 1))
-
-        pts_prop = pts_MN / MN.reshape((2, 1))
+def reconstruct_new(Iorig, I, Y, out_size, threshold=.9, rectifier=None):
+    #
+    #  Decodes plates from the output map Y of the resized image I, and rectifies them from the
+    #  original image Iorig (with rectify_plates, or a Rectifier reusing its output buffers)
+    #
+    pts, probs = decode_output_map(I, Y, threshold)
+    return plates_from_points(Iorig, pts, probs, out_size, rectifier)
 
-        labels.append(DLabel(0, pts_prop, prob))
 
-    final_labels = nms(labels, .1)
+def plates_from_points(Iorig, pts, probs, out_size, rectifier=None):
+    #
+    #  Runs NMS on the decoded corners (relative to the dimensions of Iorig), and only builds labels
+    #  and rectified plates for the selected LPs
+    #
+    keep = nms_boxes(pts.min(2), pts.max(2), probs, .1)
+    final_labels = [DLabel(0, pts[i], probs[i]) for i in keep]
     TLps = []  # list of detected plates
 
     if len(final_labels):
         final_labels.sort(key=lambda x: x.prob(), reverse=True)
-        for i, label in enumerate(final_labels):
-            ptsh = np.concatenate((label.pts * getWH(Iorig.shape).reshape((2, 1)), np.ones((1, 4))))
-            t_ptsh = getRectPts(0, 0, out_size[0], out_size[1])
-            H = find_T_matrix(ptsh, t_ptsh)
-            Ilp = cv2.warpPerspective(Iorig, H, out_size, flags=cv2.INTER_CUBIC, borderValue=.0)
-            TLps.append(Ilp)
+        quads = np.stack([label.pts for label in final_labels]) * getWH(Iorig.shape).reshape((1, 2, 1))
+        if rectifier is not None:
+            TLps = rectifier(Iorig, quads)
+        else:
+            TLps = rectify_plates(Iorig, quads, out_size)
+        if Iorig.dtype == np.uint8:
+            TLps = [im2single(Ilp) for Ilp in TLps]  # plates are float images for uint8 inputs too
     return final_labels, TLps
 
 
-def detect_lp_width(model, I, MAXWIDTH, net_step, out_size, threshold):
+def network_input_size(I, MAXWIDTH, net_step):
     #
-    #  Resizes input image and run IWPOD-NET
+    #  Finds the (w, h) input size of IWPOD-NET for image I
     #
 
     # Computes resize factor
@@ -91,52 +108,269 @@ def detect_lp_width(model, I, MAXWIDTH, net_step, out_size, threshold):
     # dimensions must be multiple of the network stride
     w += (w % net_step != 0) * (net_step - w % net_step)
     h += (h % net_step != 0) * (net_step - h % net_step)
+    return w, h
 
-    # resizes image
-    Iresized = cv2.resize(I, (w, h), interpolation=cv2.INTER_CUBIC)
-    T = Iresized.copy()
+
+def input_bucket(I, MAXWIDTH, net_step, bucket_step):
+    #
+    #  Zero-padded (w, h) input size of image I in detect_lp_width_batch: images with the same bucket
+    #  share a forward pass
+    #
+    w, h = network_input_size(I, MAXWIDTH, net_step)
+    w += (w % bucket_step != 0) * (bucket_step - w % bucket_step)
+    h += (h % bucket_step != 0) * (bucket_step - h % bucket_step)
+    return w, h
+
+
+def detect_lp_width(model, I, MAXWIDTH, net_step, out_size, threshold, device=None, preprocessor=None, rectifier=None):
+    #
+    #  Resizes input image and run IWPOD-NET. I is a float image in [0, 1] (im2single), or with a
+    #  Preprocessor, also a uint8 image, which is then resized into preallocated buffers without
+    #  converting it to float at full resolution. A Rectifier (src.rectify) reuses plate buffers
+    #
+    w, h = network_input_size(I, MAXWIDTH, net_step)
 
     # Prepare to feed to IWPOD-NET
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    if device is None:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     with torch.no_grad():
         model.eval()
-        inputs = torch.from_numpy(T).permute(2, 0, 1).float()
-        inputs = torch.unsqueeze(inputs, dim=0).to(device)
+        if preprocessor is not None:
+            inputs, Iresized = preprocessor(I, w, h)
+        else:
+            Iresized = cv2.resize(I, (w, h), interpolation=cv2.INTER_CUBIC)
+            inputs = torch.from_numpy(Iresized).permute(2, 0, 1).float()
+            inputs = torch.unsqueeze(inputs, dim=0).to(device)
         start = time.time()
         outputs = model(inputs)
         Yr = torch.squeeze(outputs)
         elapsed = time.time() - start
 
-        L, TLps = reconstruct_new(I, Iresized, Yr, out_size, threshold)
+        L, TLps = reconstruct_new(I, Iresized, Yr, out_size, threshold, rectifier)
 
     return L, TLps, elapsed
 
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-i', '--image', type=str, default='images\\example_aolp_fullimage.jpg', help='Input Image')
-    parser.add_argument('-v', '--vtype', type=str, default='fullimage', help='Image type (car, truck, bus, bike or fullimage)')
-    parser.add_argument('-t', '--lp_threshold', type=float, default=0.35, help='Detection Threshold')
-    args = parser.parse_args()
+def detect_lp_width_batch(model, Is, MAXWIDTH, net_step, out_size, threshold, bucket_step=None, device=None):
+    #
+    #  Batched version of detect_lp_width for a list of images. Each image is resized exactly as in
+    #  detect_lp_width, and images are grouped into buckets with the same input size, running a single
+    #  forward pass per bucket. Returns one list of labels and one list of rectified plates per image.
+    #
+    #  By default (bucket_step = net_step) only images with the same resized dimensions share a bucket,
+    #  and results match detect_lp_width. A larger bucket_step (multiple of net_step) zero-pads inputs
+    #  to multiples of bucket_step, so that images of similar sizes share a forward pass; detections
+    #  close to the padded borders may then differ slightly.
+    #
+    net_stride = 2 ** 4
+    bucket_step = net_step if bucket_step is None else bucket_step
+    assert bucket_step % net_step == 0, 'bucket_step must be a multiple of net_step'
 
-    lp_threshold = args.lp_threshold
-    ocr_input_size = [80, 240]  # desired LP size (width x height)
+    #
+    #  Resizes all images and groups them by (padded) input size
+    #
+    Iresized = []
+    buckets = {}
+    for i, I in enumerate(Is):
+        w, h = network_input_size(I, MAXWIDTH, net_step)
+        Iresized.append(cv2.resize(I, (w, h), interpolation=cv2.INTER_CUBIC))
+        buckets.setdefault(input_bucket(I, MAXWIDTH, net_step, bucket_step), []).append(i)
+
+    Ls = [[] for _ in Is]
+    TLps = [[] for _ in Is]
+    elapsed = 0.
+
+    if device is None:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    with torch.no_grad():
+        model.eval()
+        for (bw, bh), idxs in buckets.items():
+            #
+            #  Stacks the bucket into a single (zero padded) batch
+            #
+            T = np.zeros((len(idxs), bh, bw, 3), dtype=Iresized[idxs[0]].dtype)
+            for j, i in enumerate(idxs):
+                h, w = Iresized[i].shape[:2]
+                T[j, :h, :w] = Iresized[i]
+
+            inputs = torch.from_numpy(T).permute(0, 3, 1, 2).float().to(device)
+            start = time.time()
+            outputs = model(inputs)
+            elapsed += time.time() - start
+
+            #
+            #  Crops the padded area from each output map and decodes plates
+            #
+            for j, i in enumerate(idxs):
+                h, w = Iresized[i].shape[:2]
+                Yr = outputs[j, :, :h // net_stride, :w // net_stride]
+                Ls[i], TLps[i] = reconstruct_new(Is[i], Iresized[i], Yr, out_size, threshold)
+
+    return Ls, TLps, elapsed
+
+
+def tile_origins(length, tile_size, overlap):
+    #
+    #  Starts of tiles covering [0, length), overlapping by at least overlap pixels
+    #
+    if length <= tile_size:
+        return [0]
+    origins = list(range(0, length - tile_size, tile_size - overlap))
+    return origins + [length - tile_size]
 
-    Ivehicle = cv2.imread(args.image)
-    vtype = args.vtype
-    iwh = np.array(Ivehicle.shape[1::-1], dtype=float).reshape((2, 1))
 
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    mymodel = IWPODNet()
-    # mymodel.load_state_dict(torch.load('weights/iwpodnet_retrained_epoch10000.pth')['model_state_dict'])                      # original
-    mymodel.load_state_dict(torch.load('weights/iwpodnet_retrained_epoch10000.pth', map_location=device)['model_state_dict'])   # Bernardo
-    mymodel.to(device)
+def make_tiles(I, tile_size=256, overlap=32, scales=(1.,), net_step=2 ** 4):
+    #
+    #  Cuts image I (uint8 or float) resized by each scale into overlapping tile_size x tile_size tiles
+    #  (tile_size must be a multiple of net_step; tiles of images smaller than a tile are zero-padded).
+    #  Returns a (N, tile_size, tile_size, 3) float batch, the (x, y) origin of each tile in its scaled
+    #  image and the scale of each tile
+    #
+    assert tile_size % net_step == 0, 'tile_size must be a multiple of %d' % net_step
+    tiles, origins, tile_scales = [], [], []
+    for scale in scales:
+        w, h = max(1, int(round(I.shape[1] * scale))), max(1, int(round(I.shape[0] * scale)))
+        Is = cv2.resize(I, (w, h), interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC) if scale != 1 else I
+        Is = im2single(Is) if Is.dtype == np.uint8 else Is
+        for y0 in tile_origins(h, tile_size, overlap):
+            for x0 in tile_origins(w, tile_size, overlap):
+                tile = Is[y0:y0 + tile_size, x0:x0 + tile_size]
+                if tile.shape[:2] != (tile_size, tile_size):
+                    tile = cv2.copyMakeBorder(tile, 0, tile_size - tile.shape[0], 0, tile_size - tile.shape[1], cv2.BORDER_CONSTANT, value=0)
+                tiles.append(tile)
+                origins.append((x0, y0))
+                tile_scales.append(scale)
+    return np.stack(tiles).astype(np.float32, copy=False), np.array(origins, dtype=float), np.array(tile_scales)
+
+
+def decode_tiles(I, outputs, origins, tile_scales, tile_size, threshold):
+    #
+    #  Decodes the output maps of all tiles, mapping the LP corners back to coordinates relative to the
+    #  dimensions of image I
+    #
+    tile = np.empty((tile_size, tile_size, 0))  # only its dimensions are used by decode_output_map
+    WH = getWH(I.shape).reshape((1, 2, 1))
+    all_pts, all_probs = [np.zeros((0, 2, 4))], [np.zeros(0)]
+    for Y, origin, scale in zip(outputs, origins, tile_scales):
+        pts, probs = decode_output_map(tile, Y, threshold)
+        all_pts.append((pts * tile_size + origin.reshape((1, 2, 1))) / scale / WH)
+        all_probs.append(probs)
+    return np.concatenate(all_pts), np.concatenate(all_probs)
+
+
+def detect_lp_tiled(model, I, out_size, threshold, tile_size=256, overlap=32, scales=(1.,), batch_size=16, device=None, rectifier=None):
+    #
+    #  Tiled / multi-scale detection for large images, where small plates vanish when the whole image
+    #  is resized to the network input width. All tiles of all scales go through the network in
+    #  batches of batch_size, and detections of every tile are merged by a single NMS
+    #
+    if device is None:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    tiles, origins, tile_scales = make_tiles(I, tile_size, overlap, scales)
+
+    elapsed = 0.
+    outputs = []
+    with torch.no_grad():
+        model.eval()
+        for start in range(0, len(tiles), batch_size):
+            inputs = torch.from_numpy(tiles[start:start + batch_size]).permute(0, 3, 1, 2).to(device)
+            start_time = time.time()
+            outputs.append(model(inputs).cpu())
+            elapsed += time.time() - start_time
+        outputs = torch.cat(outputs)
+
+    pts, probs = decode_tiles(I, outputs, origins, tile_scales, tile_size, threshold)
+    L, TLps = plates_from_points(I, pts, probs, out_size, rectifier)
+    return L, TLps, elapsed
+
+
+def detect_lp_cascade(model, I, MAXWIDTH, out_size, threshold, coarse_threshold=None, fine_scale=1., padding=.5,
+                      max_regions=8, max_crop=640, net_step=2 ** 4, device=None, rectifier=None):
+    #
+    #  Coarse-to-fine detection: a pass at MAXWIDTH (as in detect_lp_width) finds candidate plates with
+    #  probability above coarse_threshold (default threshold / 2), and a second pass runs only on crops
+    #  of I around the best max_regions of them, enlarged by padding (relative to the plate size) on
+    #  each side and resized by fine_scale (relative to I; crops are shrunk to at most max_crop pixels).
+    #  Final plates come from the fine pass only, giving close to high resolution accuracy at a cost
+    #  close to the coarse pass when plates cover a small part of the image
+    #
+    if device is None:
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    if coarse_threshold is None:
+        coarse_threshold = threshold / 2.
+    net_stride = 2 ** 4
+    H, W = I.shape[:2]
+    WH = np.array([W, H], dtype=float)
+    Ifloat = im2single(I) if I.dtype == np.uint8 else I
+
+    elapsed = 0.
+    with torch.no_grad():
+        model.eval()
+
+        #
+        #  Coarse pass: candidate regions from the NMS of the low resolution detections
+        #
+        w, h = network_input_size(I, MAXWIDTH, net_step)
+        Iresized = cv2.resize(Ifloat, (w, h), interpolation=cv2.INTER_CUBIC)
+        inputs = torch.from_numpy(Iresized).permute(2, 0, 1).unsqueeze(0).to(device)
+        start = time.time()
+        Y = model(inputs)[0]
+        elapsed += time.time() - start
+        pts, probs = decode_output_map(Iresized, Y, coarse_threshold)
+        keep = nms_boxes(pts.min(2), pts.max(2), probs, .1, max_count=max_regions)
+        if len(keep) == 0:
+            return [], [], elapsed
+
+        #
+        #  Padded crops around the candidates, resized by fine_scale and zero-padded into one batch
+        #
+        tl, br = pts[keep].min(2) * WH, pts[keep].max(2) * WH
+        margin = (br - tl) * padding
+        tl = np.maximum(np.floor(tl - margin), 0).astype(int)
+        br = np.minimum(np.ceil(br + margin), WH).astype(int)
+        crops, origins, scales = [], [], []
+        for (x0, y0), (x1, y1) in zip(tl, br):
+            scale = min(fine_scale, max_crop / max(x1 - x0, y1 - y0))
+            cw, ch = max(1, int(round((x1 - x0) * scale))), max(1, int(round((y1 - y0) * scale)))
+            crops.append(cv2.resize(Ifloat[y0:y1, x0:x1], (cw, ch), interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC))
+            origins.append((x0, y0))
+            scales.append(((x1 - x0) / cw, (y1 - y0) / ch))
+        bh = max(net_step * -(-crop.shape[0] // net_step) for crop in crops)
+        bw = max(net_step * -(-crop.shape[1] // net_step) for crop in crops)
+        T = np.zeros((len(crops), bh, bw, 3), dtype=np.float32)
+        for j, crop in enumerate(crops):
+            T[j, :crop.shape[0], :crop.shape[1]] = crop
+
+        #
+        #  Fine pass, mapping the corners found in each crop back to coordinates relative to I
+        #
+        inputs = torch.from_numpy(T).permute(0, 3, 1, 2).to(device)
+        start = time.time()
+        outputs = model(inputs).cpu()
+        elapsed += time.time() - start
+
+    all_pts, all_probs = [np.zeros((0, 2, 4))], [np.zeros(0)]
+    padded = np.empty((bh, bw, 0))  # only its dimensions are used by decode_output_map
+    for Yc, origin, scale in zip(outputs, origins, scales):
+        pts, probs = decode_output_map(padded, Yc, threshold)
+        pts = pts * np.array([bw, bh], dtype=float).reshape((1, 2, 1)) * np.reshape(scale, (1, 2, 1))
+        all_pts.append((pts + np.reshape(origin, (1, 2, 1))) / WH.reshape((1, 2, 1)))
+        all_probs.append(probs)
+
+    L, TLps = plates_from_points(I, np.concatenate(all_pts), np.concatenate(all_probs), out_size, rectifier)
+    return L, TLps, elapsed
+
 
+def vtype_parameters(vtype, I, ocr_input_size=(80, 240)):
+    #
+    #  Returns the maximum input width of IWPOD-NET and the size of rectified plates for each image
+    #  type (car, truck, bus, bike or fullimage). ocr_input_size is the desired LP size (width x height)
+    #
     if vtype in ['car', 'bus', 'truck']:
         #
         #  Defines crops for car, bus, truck based on input aspect ratio (see paper)
         #
-        ASPECTRATIO = max(1.0, min(2.75, 1.0 * Ivehicle.shape[1] / Ivehicle.shape[0]))  # width over height
+        ASPECTRATIO = max(1.0, min(2.75, 1.0 * I.shape[1] / I.shape[0]))  # width over height
         WPODResolution = 256  # faster execution
         lp_output_resolution = tuple(ocr_input_size[::-1])
     elif vtype == 'fullimage':
@@ -156,7 +390,242 @@ if __name__ == '__main__':
         WPODResolution = 208
         lp_output_resolution = (int(1.5 * ocr_input_size[0]), ocr_input_size[0])  # for bikes, the LP aspect ratio is lower
 
-    Llp, LlpImgs, _ = detect_lp_width(mymodel, im2single(Ivehicle), WPODResolution * ASPECTRATIO, 2 ** 4, lp_output_resolution, lp_threshold)
+    return WPODResolution * ASPECTRATIO, lp_output_resolution
+
+
+def plates_json(L, I):
+    #
+    #  JSON-serializable plates: quadrilateral corners in pixels of image I, and probabilities
+    #
+    wh = np.array(I.shape[1::-1], dtype=float).reshape((2, 1))
+    return [{'quad': (label.pts * wh).T.tolist(), 'prob': float(label.prob())} for label in L]
+
+
+def walk_images(root, subdir=None, extensions=('.jpg', '.jpeg', '.png')):
+    #
+    #  Yields image paths under root in a deterministic order. If subdir is given, only images in
+    #  directories with that name are listed (e.g. subdir='imgs' for <root>/<vistoria>/imgs/*.jpg)
+    #
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        if subdir is not None and os.path.basename(dirpath) != subdir:
+            continue
+        for filename in sorted(filenames):
+            if filename.lower().endswith(extensions):
+                yield os.path.join(dirpath, filename)
+
+
+def processed_images(output_path):
+    #
+    #  Images already in a JSONL output file. A last line truncated by an interrupted run is ignored,
+    #  and so are images that failed: they are processed again
+    #
+    done = set()
+    if os.path.isfile(output_path):
+        with open(output_path) as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if 'image' in record and 'error' not in record:
+                    done.add(record['image'])
+    return done
+
+
+def detection_pipeline(model, vtype, threshold, ocr_input_size=(80, 240), decode_workers=4, post_workers=2, queue_size=16,
+                       tiling=None, cascade=None):
+    #
+    #  Pipelined detection over image paths: decoding and resizing (pool of decode_workers threads),
+    #  inference (a single thread running the model) and NMS + plate rectification (pool of post_workers
+    #  threads), connected by queues of queue_size items. Running pipeline.run(paths) yields dicts with
+    #  'path', 'image' (None if unreadable), 'labels', 'plates' (rectified) and 'time' in completion order
+    #  (and with yield_failures, a Failure with the path of each image on which a stage raised).
+    #  tiling is None, or a dict with the tile_size, overlap and scales of detect_lp_tiled, and cascade is
+    #  None, or a dict with the arguments of detect_lp_cascade (which then runs in the inference stage)
+    #
+    net_step = 2 ** 4
+
+    def preprocess(path):
+        item = {'path': path, 'start': time.time()}
+        I = cv2.imread(path)
+        item['image'] = I
+        if I is None:
+            return item
+        MAXWIDTH, item['out_size'] = vtype_parameters(vtype, I, ocr_input_size)
+        if cascade is not None:
+            item['maxwidth'] = MAXWIDTH
+            return item
+        if tiling is not None:
+            item['tiles'], item['origins'], item['tile_scales'] = make_tiles(I, **tiling)
+            return item
+        w, h = network_input_size(I, MAXWIDTH, net_step)
+        item['resized'] = im2single(cv2.resize(I, (w, h), interpolation=cv2.INTER_CUBIC))  # only the resized image in float
+        return item
+
+    def infer(item):
+        if item['image'] is not None:
+            with torch.no_grad():
+                if cascade is not None:
+                    item['labels'], item['plates'], _ = detect_lp_cascade(model, item['image'], item['maxwidth'], item['out_size'],
+                                                                          threshold, device=model.device, **cascade)
+                elif tiling is not None:
+                    tiles = torch.from_numpy(item.pop('tiles')).permute(0, 3, 1, 2)
+                    item['output'] = torch.cat([model(tiles[i:i + 16].to(model.device)).cpu() for i in range(0, len(tiles), 16)])
+                else:
+                    inputs = torch.from_numpy(item['resized']).permute(2, 0, 1).float().unsqueeze(0).to(model.device)
+                    item['output'] = model(inputs)[0].cpu()
+        return item
+
+    def postprocess(item):
+        if item['image'] is None:
+            item['labels'], item['plates'] = [], []
+        elif cascade is not None:
+            pass  # labels and plates were found in the inference stage
+        elif tiling is not None:
+            pts, probs = decode_tiles(item['image'], item.pop('output'), item.pop('origins'), item.pop('tile_scales'),
+                                      tiling['tile_size'], threshold)
+            item['labels'], item['plates'] = plates_from_points(item['image'], pts, probs, item['out_size'])
+        else:
+            item['labels'], item['plates'] = reconstruct_new(item['image'], item.pop('resized'), item.pop('output'),
+                                                             item['out_size'], threshold)
+        item['time'] = time.time() - item.pop('start')
+        return item
+
+    model.eval()
+    return Pipeline([Stage('decode', preprocess, decode_workers), Stage('inference', infer, 1),
+                     Stage('postprocess', postprocess, post_workers)], queue_size)
+
+
+def detect_directory(model, root, output_path, vtype, threshold, subdir=None, crops_dir=None, ocr_input_size=(80, 240),
+                     decode_workers=4, post_workers=2, tiling=None, cascade=None):
+    #
+    #  Headless batch detection over a folder tree, appending one JSON line per image to output_path
+    #  as it goes ({"image", "plates", "time"}, or {"image", "error"} for an image that could not be read
+    #  or processed, without stopping the run). Images already in output_path are skipped, so that an
+    #  interrupted run can simply be restarted (failed images are tried again). Rectified plates are
+    #  written to crops_dir (mirroring the tree under root) when given. Returns the counts of processed,
+    #  skipped and failed images, and the pipeline (for its occupancy report)
+    #
+    done = processed_images(output_path)
+    if os.path.isfile(output_path) and os.path.getsize(output_path) > 0:
+        with open(output_path, 'rb') as fp:
+            fp.seek(-1, os.SEEK_END)
+            truncated = fp.read() != b'\n'
+    else:
+        truncated = False
+
+    skipped = [0]
+
+    def pending():
+        for path in walk_images(root, subdir):
+            if path in done:
+                skipped[0] += 1
+            else:
+                yield path
+
+    pipeline = detection_pipeline(model, vtype, threshold, ocr_input_size, decode_workers, post_workers, tiling=tiling, cascade=cascade)
+    count = failed = 0
+    with open(output_path, 'a') as out:
+        if truncated:
+            out.write('\n')
+        for item in pipeline.run(pending(), yield_failures=True):
+            if isinstance(item, Failure) or item['image'] is None:
+                if isinstance(item, Failure):
+                    path, error = item.item, '%s: %s: %s' % (item.stage, type(item.exception).__name__, item.exception)
+                else:
+                    path, error = item['path'], 'unreadable image'
+                print('%s: %s' % (path, error), file=sys.stderr)
+                out.write(json.dumps({'image': path, 'error': error}) + '\n')
+                out.flush()
+                failed += 1
+                continue
+
+            path = item['path']
+
+            plates = plates_json(item['labels'], item['image'])
+            if crops_dir is not None:
+                crop_base = os.path.join(crops_dir, os.path.splitext(os.path.relpath(path, root))[0])
+                os.makedirs(os.path.dirname(crop_base), exist_ok=True)
+                for i, (plate, Ilp) in enumerate(zip(plates, item['plates'])):
+                    plate['crop'] = crop_base + '_plate%d.png' % i
+                    cv2.imwrite(plate['crop'], np.clip(Ilp * 255., 0, 255).astype(np.uint8))
+
+            out.write(json.dumps({'image': path, 'plates': plates, 'time': item['time']}) + '\n')
+            out.flush()
+            count += 1
+    return count, skipped[0], failed, pipeline
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--image', type=str, default=os.path.join('images', 'example_aolp_fullimage.jpg'), help='Input Image')
+    parser.add_argument('-d', '--input-dir', type=str, default=None, help='Batch mode: detects plates in all images under this directory (no display)')
+    parser.add_argument('-s', '--subdir', type=str, default=None, help='Batch mode: only images in directories with this name (e.g. imgs)')
+    parser.add_argument('-o', '--output', type=str, default='detections.jsonl', help='Batch mode: JSONL output, also used to skip processed images on restart')
+    parser.add_argument('-c', '--crops-dir', type=str, default=None, help='Writes rectified plates to this directory')
+    parser.add_argument('--decode-workers', type=int, default=4, help='Batch mode: threads decoding and resizing images')
+    parser.add_argument('--post-workers', type=int, default=2, help='Batch mode: threads running NMS and plate rectification')
+    parser.add_argument('--tiled', action='store_true', help='Tiled / multi-scale detection for large images (instead of resizing them to the vtype width)')
+    parser.add_argument('--tile-size', type=int, default=256, help='Tiled mode: tile size (multiple of 16)')
+    parser.add_argument('--overlap', type=int, default=32, help='Tiled mode: minimum overlap between tiles, in pixels')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.], help='Tiled mode: image scales (e.g. 0.5 1)')
+    parser.add_argument('--cascade', action='store_true', help='Coarse-to-fine detection: a pass at the vtype width finds candidates, refined on high resolution crops')
+    parser.add_argument('--fine-scale', type=float, default=1., help='Cascade mode: scale of the refined crops, relative to the input image')
+    parser.add_argument('--cascade-padding', type=float, default=.5, help='Cascade mode: padding around candidates, relative to their size')
+    parser.add_argument('--headless', action='store_true', help='Prints detections of --image as JSON instead of displaying them')
+    parser.add_argument('-v', '--vtype', type=str, default='fullimage', help='Image type (car, truck, bus, bike or fullimage)')
+    parser.add_argument('-t', '--lp_threshold', type=float, default=0.35, help='Detection Threshold')
+    parser.add_argument('--no-fuse', action='store_true', help='Keeps BatchNorm layers separate instead of folding them into the convolutions')
+    parser.add_argument('-b', '--backend', type=str, default='eager', choices=BACKENDS, help='Inference backend (torchscript and onnx models are created with export.py)')
+    parser.add_argument('-m', '--model', type=str, default='weights/iwpodnet_retrained_epoch10000.pth', help='Model checkpoint (eager) or exported model')
+    parser.add_argument('--int8', type=str, default=None, help='Runs the int8 model created by quantize.py (CPU only) instead of the fp32 model')
+    args = parser.parse_args()
+
+    lp_threshold = args.lp_threshold
+    ocr_input_size = [80, 240]  # desired LP size (width x height)
+    vtype = args.vtype
+
+    if args.int8 is not None:
+        mymodel = load_backend('torchscript', args.int8)
+    else:
+        mymodel = load_backend(args.backend, args.model, fuse=not args.no_fuse)
+    device = mymodel.device
+
+    tiling = {'tile_size': args.tile_size, 'overlap': args.overlap, 'scales': args.scales} if args.tiled else None
+    cascade = {'fine_scale': args.fine_scale, 'padding': args.cascade_padding} if args.cascade else None
+
+    if args.input_dir is not None:
+        count, skipped, failed, pipeline = detect_directory(mymodel, args.input_dir, args.output, vtype, lp_threshold, args.subdir,
+                                                            args.crops_dir, ocr_input_size, args.decode_workers, args.post_workers, tiling, cascade)
+        print('%d images processed in %.1f s (%d already in %s, %d failed)' % (count, pipeline.elapsed, skipped, args.output, failed))
+        print(pipeline.report())
+        sys.exit(0)
+
+    Ivehicle = cv2.imread(args.image)
+    iwh = np.array(Ivehicle.shape[1::-1], dtype=float).reshape((2, 1))
+
+    MAXWIDTH, lp_output_resolution = vtype_parameters(vtype, Ivehicle, ocr_input_size)
+
+    if cascade is not None:
+        Llp, LlpImgs, _ = detect_lp_cascade(mymodel, Ivehicle, MAXWIDTH, lp_output_resolution, lp_threshold, device=device, **cascade)
+    elif tiling is not None:
+        Llp, LlpImgs, _ = detect_lp_tiled(mymodel, Ivehicle, lp_output_resolution, lp_threshold, device=device, **tiling)
+    else:
+        Llp, LlpImgs, _ = detect_lp_width(mymodel, Ivehicle, MAXWIDTH, 2 ** 4, lp_output_resolution, lp_threshold, device=device,
+                                          preprocessor=Preprocessor(device))
+
+    if args.crops_dir is not None:
+        os.makedirs(args.crops_dir, exist_ok=True)
+        for i, img in enumerate(LlpImgs):
+            cv2.imwrite(os.path.join(args.crops_dir, '%s_plate%d.png' % (os.path.splitext(os.path.basename(args.image))[0], i)),
+                        np.clip(img * 255., 0, 255).astype(np.uint8))
+
+    if args.headless:
+        print(json.dumps({'image': args.image, 'plates': plates_json(Llp, Ivehicle)}))
+        sys.exit(0)
+
+    import tkinter as tk  # only used to find the screen size
 
     for i, img in enumerate(LlpImgs):
         #
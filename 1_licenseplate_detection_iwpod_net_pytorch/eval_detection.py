@@ -0,0 +1,82 @@
+import argparse
+import time
+
+import numpy as np
+
+from detect import detect_lp_width, detect_lp_tiled, detect_lp_cascade, vtype_parameters
+from src.utils import im2single, image_files_from_folder
+from src.backends import BACKENDS, load_backend
+from src.evaluation import evaluate_folder, summary
+
+#
+#  Recall / latency trade-offs of the detection modes on an annotated folder (annotations in the
+#  train_dir format). Latency is the whole detection time of each image, network and plate
+#  rectification included
+#
+
+
+def single_pass(model, vtype, threshold):
+    def detect(I):
+        start = time.time()
+        MAXWIDTH, lp_output_resolution = vtype_parameters(vtype, I)
+        L, _, _ = detect_lp_width(model, im2single(I), MAXWIDTH, 2 ** 4, lp_output_resolution, threshold, device=model.device)
+        return L, time.time() - start
+    return detect
+
+
+def tiled(model, vtype, threshold, tile_size, overlap, scales):
+    def detect(I):
+        start = time.time()
+        _, lp_output_resolution = vtype_parameters(vtype, I)
+        L, _, _ = detect_lp_tiled(model, I, lp_output_resolution, threshold, tile_size, overlap, scales, device=model.device)
+        return L, time.time() - start
+    return detect
+
+
+def cascade(model, vtype, threshold, fine_scale, padding):
+    def detect(I):
+        start = time.time()
+        MAXWIDTH, lp_output_resolution = vtype_parameters(vtype, I)
+        L, _, _ = detect_lp_cascade(model, I, MAXWIDTH, lp_output_resolution, threshold, fine_scale=fine_scale, padding=padding,
+                                    device=model.device)
+        return L, time.time() - start
+    return detect
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-e', '--eval-dir', type=str, default='train_dir', help='Directory with annotated images')
+    parser.add_argument('-b', '--backend', type=str, default='eager', choices=BACKENDS, help='Inference backend')
+    parser.add_argument('-m', '--model', type=str, default='weights/iwpodnet_retrained_epoch10000.pth', help='Model checkpoint (eager) or exported model')
+    parser.add_argument('-v', '--vtype', type=str, default='fullimage', help='Image type of the single pass baseline (car, truck, bus, bike or fullimage)')
+    parser.add_argument('-t', '--lp_threshold', type=float, default=0.35, help='Detection Threshold')
+    parser.add_argument('-n', '--max-images', type=int, default=0, help='Evaluates only the first n images (default = 0, all)')
+    parser.add_argument('--tile-sizes', type=int, nargs='*', default=[256, 384], help='Tile sizes to evaluate (multiples of 16)')
+    parser.add_argument('--overlaps', type=int, nargs='*', default=[32], help='Tile overlaps to evaluate')
+    parser.add_argument('--scales', type=str, nargs='*', default=['1', '0.5,1'], help='Scale sets to evaluate, each a comma-separated list')
+    parser.add_argument('--fine-scales', type=float, nargs='*', default=[1., .5], help='Fine scales of the cascade mode to evaluate')
+    parser.add_argument('--cascade-padding', type=float, default=.5, help='Padding around cascade candidates, relative to their size')
+    args = parser.parse_args()
+
+    files = sorted(image_files_from_folder(args.eval_dir))
+    if args.max_images > 0:
+        files = files[:args.max_images]
+    model = load_backend(args.backend, args.model)
+    print('%d images from %s' % (len(files), args.eval_dir))
+
+    modes = [('single pass (%s)' % args.vtype, single_pass(model, args.vtype, args.lp_threshold))]
+    for tile_size in args.tile_sizes:
+        for overlap in args.overlaps:
+            for scales in args.scales:
+                scales = [float(scale) for scale in scales.split(',')]
+                name = 'tiled %d/%d x %s' % (tile_size, overlap, ','.join('%g' % scale for scale in scales))
+                modes.append((name, tiled(model, args.vtype, args.lp_threshold, tile_size, overlap, scales)))
+
+    for fine_scale in args.fine_scales:
+        modes.append(('cascade x %g' % fine_scale, cascade(model, args.vtype, args.lp_threshold, fine_scale, args.cascade_padding)))
+
+    for name, detect in modes:
+        detect(np.zeros((64, 64, 3), dtype=np.uint8))  # warm-up
+        stats = evaluate_folder(files, detect)
+        print('%-28s %s' % (name, summary(stats)))
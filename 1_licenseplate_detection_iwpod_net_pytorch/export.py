@@ -0,0 +1,105 @@
+import argparse
+import inspect
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from detect import detect_lp_width, vtype_parameters
+from src.model import IWPODNet
+from src.utils import im2single, image_files_from_folder
+from src.backends import load_backend
+
+
+def export_torchscript(model, path):
+    #
+    #  Scripted (not traced) so that nothing depends on the example size; freezing folds the
+    #  parameters into the graph
+    #
+    scripted = torch.jit.freeze(torch.jit.script(model))
+    torch.jit.save(scripted, path)
+
+
+def export_onnx(model, path, opset=13):
+    #
+    #  Batch, height and width are dynamic (height and width must be multiples of 16).
+    #  The TorchScript-based exporter is used, also on PyTorch versions defaulting to the dynamo
+    #  exporter (which requires onnxscript)
+    #
+    example = torch.zeros(1, 3, 256, 256)
+    options = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+    torch.onnx.export(model, example, path, opset_version=opset, input_names=['image'], output_names=['output'],
+                      dynamic_axes={'image': {0: 'batch', 2: 'height', 3: 'width'},
+                                    'output': {0: 'batch', 2: 'height_16', 3: 'width_16'}}, **options)
+
+
+def report_latency(name, path, files, vtype, threshold, fuse=True):
+    #
+    #  Startup (loading the backend and a first inference) and per-image latency (network only, and
+    #  the whole detect_lp_width call including resizing and plate rectification)
+    #
+    start = time.time()
+    backend = load_backend(name, path, fuse=fuse)
+    load_time = time.time() - start
+    I = im2single(cv2.imread(files[0]))
+    MAXWIDTH, lp_output_resolution = vtype_parameters(vtype, I)
+    start = time.time()
+    detect_lp_width(backend, I, MAXWIDTH, 2 ** 4, lp_output_resolution, threshold, device=backend.device)
+    first_time = time.time() - start
+
+    forward_times, total_times = [], []
+    for file in files:
+        I = im2single(cv2.imread(file))
+        MAXWIDTH, lp_output_resolution = vtype_parameters(vtype, I)
+        start = time.time()
+        _, _, elapsed = detect_lp_width(backend, I, MAXWIDTH, 2 ** 4, lp_output_resolution, threshold, device=backend.device)
+        total_times.append(time.time() - start)
+        forward_times.append(elapsed)
+
+    forward_times, total_times = 1000 * np.array(forward_times), 1000 * np.array(total_times)
+    print('%-12s startup %7.1f ms (load %.1f ms + first image %.1f ms), per image: network %.2f ms (p50 %.2f), total %.2f ms (p50 %.2f)' % (
+        name, 1000 * (load_time + first_time), 1000 * load_time, 1000 * first_time, forward_times.mean(),
+        np.median(forward_times), total_times.mean(), np.median(total_times)))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--weights', type=str, default='weights/iwpodnet_retrained_epoch10000.pth', help='Model checkpoint')
+    parser.add_argument('-o', '--output', type=str, default='weights/iwpodnet', help='Output path without extension (.pt for TorchScript, .onnx for ONNX)')
+    parser.add_argument('-f', '--formats', type=str, nargs='+', default=['torchscript', 'onnx'], choices=['torchscript', 'onnx'], help='Export formats')
+    parser.add_argument('--opset', type=int, default=13, help='ONNX opset version')
+    parser.add_argument('-i', '--images', type=str, default='images', help='Images used to report the latency of each backend (empty to skip)')
+    parser.add_argument('-v', '--vtype', type=str, default='fullimage', help='Image type (car, truck, bus, bike or fullimage)')
+    parser.add_argument('-t', '--lp_threshold', type=float, default=0.35, help='Detection Threshold')
+    args = parser.parse_args()
+
+    model = IWPODNet()
+    model.load_state_dict(torch.load(args.weights, map_location='cpu')['model_state_dict'])
+    model.fuse()
+
+    paths = {'eager': args.weights}
+    if 'torchscript' in args.formats:
+        paths['torchscript'] = args.output + '.pt'
+        export_torchscript(model, paths['torchscript'])
+    if 'onnx' in args.formats:
+        paths['onnx'] = args.output + '.onnx'
+        export_onnx(model, paths['onnx'], args.opset)
+
+    #
+    #  Checks that exported models give the eager outputs at an input size other than the export one
+    #
+    inputs = torch.rand(2, 3, 192, 320)
+    with torch.no_grad():
+        expected = model(inputs)
+        for name in args.formats:
+            outputs = load_backend(name, paths[name], device='cpu')(inputs)
+            print('Exported %s model at: %s (max abs difference to eager outputs: %.2e)' % (
+                name, paths[name], (outputs - expected).abs().max().item()))
+
+    if args.images:
+        files = sorted(image_files_from_folder(args.images))
+        with torch.no_grad():
+            for name, path in paths.items():
+                report_latency(name, path, files, args.vtype, args.lp_threshold)
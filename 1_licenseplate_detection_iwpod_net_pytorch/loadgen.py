@@ -0,0 +1,66 @@
+import argparse
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from client import DetectionClient
+from src.utils import image_files_from_folder
+
+#
+#  Load generator for serve.py: a number of concurrent clients send images from a folder in a closed
+#  loop (each client sends its next request as soon as it gets a response)
+#
+
+
+def run_client(args, images, latencies, batch_sizes, errors, index):
+    client = DetectionClient(args.host, args.port)
+    for n in range(args.requests):
+        image = images[(index + n * args.concurrency) % len(images)]
+        start = time.time()
+        try:
+            result = client.detect(image, args.vtype, args.lp_threshold, args.crops)
+        except Exception as e:
+            errors.append(str(e))
+            client = DetectionClient(args.host, args.port)
+            continue
+        latencies.append(time.time() - start)
+        batch_sizes[result['batch_size']] += 1
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--images', type=str, default='images', help='Directory with the images to send')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Server address')
+    parser.add_argument('-p', '--port', type=int, default=8080, help='Server port')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='Number of concurrent clients')
+    parser.add_argument('-n', '--requests', type=int, default=20, help='Requests sent by each client')
+    parser.add_argument('-v', '--vtype', type=str, default=None, help='Image type (default = the server default)')
+    parser.add_argument('-t', '--lp_threshold', type=float, default=None, help='Detection threshold (default = the server default)')
+    parser.add_argument('--crops', action='store_true', help='Requests rectified plates')
+    args = parser.parse_args()
+
+    images = []
+    for path in sorted(image_files_from_folder(args.images)):
+        with open(path, 'rb') as fp:
+            images.append(fp.read())
+    print('%d images loaded, %d clients x %d requests' % (len(images), args.concurrency, args.requests))
+    print('Server: %s' % DetectionClient(args.host, args.port).health())
+
+    latencies, errors, batch_sizes = [], [], Counter()
+    threads = [threading.Thread(target=run_client, args=(args, images, latencies, batch_sizes, errors, i))
+               for i in range(args.concurrency)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    latencies = 1000 * np.array(latencies or [0.])
+    print('%d requests in %.2f s: %.1f images/s, %d errors' % (len(latencies), elapsed, len(latencies) / elapsed, len(errors)))
+    print('Latency: mean %.1f ms, p50 %.1f ms, p95 %.1f ms, p99 %.1f ms' % (
+        latencies.mean(), np.percentile(latencies, 50), np.percentile(latencies, 95), np.percentile(latencies, 99)))
+    print('Forward batch sizes (requests): %s' % ', '.join('%d: %d' % item for item in sorted(batch_sizes.items())))
@@ -0,0 +1,92 @@
+import argparse
+import time
+
+import torch
+
+from src.loss import clas_loss, l1, loc_loss
+
+#
+#  Micro-benchmark of loc_loss (forward and backward) against the original implementation, which
+#  built and permuted a (b, h, w, 12) base tensor and concatenated the corners in a loop. Also the
+#  reference of tests/test_loss.py
+#
+
+
+def legacy_loc_loss(Ytrue, Ypred):
+    b, h, w = Ytrue.size(0), Ytrue.size(2), Ytrue.size(3)
+
+    obj_probs_true = Ytrue[:, 0, ...]
+    affine_pred = Ypred[:, 1:, ...]
+    pts_true = Ytrue[:, 1:, ...]
+
+    affinex = torch.stack([torch.clamp(affine_pred[:, 0, ...], min=0.), affine_pred[:, 1, ...], affine_pred[:, 2, ...]], 1)
+    affiney = torch.stack([affine_pred[:, 3, ...], torch.clamp(affine_pred[:, 4, ...], min=0.), affine_pred[:, 5, ...]], 1)
+
+    v = 0.5
+    base = torch.tensor([-v, -v, 1., v, -v, 1., v, v, 1., -v, v, 1.], device=Ypred.device)
+    base = base.repeat(b, h, w, 1)
+    base = base.permute(0, 3, 1, 2)
+
+    pts = torch.zeros((b, 0, h, w), device=Ypred.device)
+
+    for i in range(0, 12, 3):
+        row = base[:, i:(i + 3), ...]
+        ptsx = torch.sum(affinex * row, 1)
+        ptsy = torch.sum(affiney * row, 1)
+
+        pts_xy = torch.stack([ptsx, ptsy], 1)
+        pts = torch.cat([pts, pts_xy], 1)
+
+    flags = obj_probs_true.view(b, 1, h, w)
+    res = 1.0 * l1(pts_true * flags, pts * flags, (b, h, w, 4 * 2))
+    return res
+
+
+def legacy_iwpodnet_loss(Ytrue, Ypred):
+    return 0.5 * legacy_loc_loss(Ytrue, Ypred) + 0.5 * clas_loss(Ytrue, Ypred)
+
+
+def random_maps(b, h, w, device=None, seed=0):
+    #
+    #  Ground truth (binary labels and corners) and predictions (probability and affine channels)
+    #
+    g = torch.Generator().manual_seed(seed)
+    Ytrue = torch.cat([(torch.rand((b, 1, h, w), generator=g) < .2).float(), torch.randn((b, 8, h, w), generator=g)], 1)
+    Ypred = torch.cat([torch.rand((b, 1, h, w), generator=g), torch.randn((b, 6, h, w), generator=g)], 1)
+    return Ytrue.to(device), Ypred.to(device)
+
+
+def time_loss(loss_fn, Ytrue, Ypred, runs):
+    #
+    #  Mean time (seconds) of forward and backward, after a warm-up call
+    #
+    Ypred = Ypred.clone().requires_grad_()
+    for run in range(runs + 1):
+        if run == 1:
+            if Ypred.device.type == 'cuda':
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+        loss_fn(Ytrue, Ypred).mean().backward()
+    if Ypred.device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / runs
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sizes', type=str, nargs='*', default=['32x13x13', '4x30x40', '64x13x13'], help='Output map sizes (batch x height x width)')
+    parser.add_argument('-r', '--runs', type=int, default=100, help='Timed forward and backward passes of each size')
+    parser.add_argument('-j', '--threads', type=int, default=None, help='PyTorch threads (default = PyTorch default)')
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    for size in args.sizes:
+        b, h, w = [int(v) for v in size.lower().split('x')]
+        Ytrue, Ypred = random_maps(b, h, w, device)
+        legacy = time_loss(legacy_loc_loss, Ytrue, Ypred, args.runs)
+        current = time_loss(loc_loss, Ytrue, Ypred, args.runs)
+        print('%-10s legacy %7.3f ms  current %7.3f ms  (%.2fx)' % (size, 1000 * legacy, 1000 * current, legacy / current))
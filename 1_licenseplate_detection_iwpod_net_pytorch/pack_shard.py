@@ -0,0 +1,15 @@
+import argparse
+
+from src.dataset import image_label_loader
+from src.shard import write_shard
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-tr', '--train-dir', type=str, default='train_dir', help='Input data directory for training')
+    parser.add_argument('-o', '--output', type=str, default='train_dir.shard', help='Output shard directory')
+    args = parser.parse_args()
+
+    data = image_label_loader(args.train_dir, lazy=True)
+    write_shard(data, args.output)
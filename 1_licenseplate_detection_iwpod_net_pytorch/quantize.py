@@ -0,0 +1,86 @@
+import argparse
+import os
+import random
+
+import cv2
+import numpy as np
+import torch
+
+from detect import detect_lp_width, network_input_size, vtype_parameters
+from src.model import IWPODNet
+from src.utils import im2single, image_files_from_folder
+from src.evaluation import evaluate_folder, summary
+from src.backends import load_backend
+from src.quantization import quantize_model, save_quantized
+
+
+def calibration_inputs(files, vtype, net_step=2 ** 4):
+    #
+    #  Network inputs for calibration, resized exactly as in detect_lp_width
+    #
+    for file in files:
+        I = cv2.imread(file)
+        if I is None:
+            continue
+        MAXWIDTH, _ = vtype_parameters(vtype, I)
+        w, h = network_input_size(I, MAXWIDTH, net_step)
+        Iresized = cv2.resize(im2single(I), (w, h), interpolation=cv2.INTER_CUBIC)
+        yield torch.from_numpy(Iresized).permute(2, 0, 1).float().unsqueeze(0)
+
+
+def detector(model, vtype, threshold):
+    def detect(I):
+        MAXWIDTH, lp_output_resolution = vtype_parameters(vtype, I)
+        L, _, elapsed = detect_lp_width(model, im2single(I), MAXWIDTH, 2 ** 4, lp_output_resolution, threshold,
+                                        device=torch.device('cpu'))  # int8 models only run on CPU
+        return L, elapsed
+    return detect
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--weights', type=str, default='weights/iwpodnet_retrained_epoch10000.pth', help='fp32 model checkpoint')
+    parser.add_argument('-o', '--output', type=str, default='weights/iwpodnet_int8.pt', help='Output quantized model (TorchScript)')
+    parser.add_argument('-tr', '--train-dir', type=str, default='train_dir', help='Directory with calibration images')
+    parser.add_argument('-n', '--calibration-images', type=int, default=100, help='Number of calibration images drawn from train-dir (default = 100)')
+    parser.add_argument('-e', '--eval-dir', type=str, default='images', help='Held-out directory used to compare fp32 and int8 models (annotations, if present, give recall)')
+    parser.add_argument('-v', '--vtype', type=str, default='fullimage', help='Image type (car, truck, bus, bike or fullimage)')
+    parser.add_argument('-t', '--lp_threshold', type=float, default=0.35, help='Detection Threshold')
+    parser.add_argument('--backend', type=str, default='x86', choices=['x86', 'fbgemm', 'qnnpack'], help='Quantized engine (qnnpack for ARM servers)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for drawing calibration images')
+    args = parser.parse_args()
+
+    model = IWPODNet()
+    model.load_state_dict(torch.load(args.weights, map_location='cpu')['model_state_dict'])
+    model.eval()
+
+    #
+    #  Calibrates on a random subset of the training images and exports the int8 model
+    #
+    train_files = sorted(image_files_from_folder(args.train_dir))
+    calibration_files = random.Random(args.seed).sample(train_files, min(args.calibration_images, len(train_files)))
+    print('Calibrating on %d images from %s...' % (len(calibration_files), args.train_dir))
+    qmodel, example_inputs = quantize_model(model, calibration_inputs(calibration_files, args.vtype), args.backend)
+    save_quantized(qmodel, example_inputs, args.output, args.backend)
+    print('Saved quantized model at:', args.output)
+
+    #
+    #  Compares detection rate (and recall, with annotations) and forward latency with the fp32 model
+    #
+    calibration_set = set(os.path.abspath(file) for file in calibration_files)
+    eval_files = [file for file in sorted(image_files_from_folder(args.eval_dir)) if os.path.abspath(file) not in calibration_set]
+    print('Evaluating on %d images from %s...' % (len(eval_files), args.eval_dir))
+
+    stats = {}
+    for name, m in (('fp32', model.fuse()), ('int8', load_backend('torchscript', args.output))):
+        stats[name] = evaluate_folder(eval_files, detector(m, args.vtype, args.lp_threshold))
+        print('%s: %s' % (name, summary(stats[name])))
+
+    fp32, int8 = stats['fp32'], stats['int8']
+    print('Delta (int8 - fp32): %+d images with detections, %+d detections' % (
+        int8['images_with_detections'] - fp32['images_with_detections'], int8['detections'] - fp32['detections']), end='')
+    if fp32['plates'] > 0:
+        print(', recall %+.3f' % ((int8['matched_plates'] - fp32['matched_plates']) / fp32['plates']), end='')
+    print(', mean latency %.2f -> %.2f ms (%.2fx)' % (1000 * np.mean(fp32['latencies']), 1000 * np.mean(int8['latencies']),
+                                                      np.mean(fp32['latencies']) / np.mean(int8['latencies'])))
@@ -0,0 +1,206 @@
+import argparse
+import base64
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import cv2
+import numpy as np
+
+from detect import detect_lp_width_batch, input_bucket, plates_json, vtype_parameters
+from src.utils import im2single
+from src.backends import BACKENDS, load_backend
+from src.batching import MicroBatcher
+
+#
+#  Long-running detection service keeping the model loaded. Endpoints:
+#
+#    POST /detect   body with the image bytes (any format OpenCV decodes), or a JSON object
+#                   {"path": "...", "vtype": ..., "threshold": ..., "crops": ...} for images under the
+#                   image root of the server (--image-root; paths are relative to it, and reading by
+#                   path is disabled without it). vtype, threshold and crops may also be given in the
+#                   query string. Invalid requests get a 400 response
+#    GET  /health   server status
+#
+#  Responses are JSON: {"plates": [{"quad": [[x, y] x 4], "prob": p, "crop": base64 PNG}], "batch_size": n,
+#  "network_time": s, "latency": s}, with quadrilateral corners in pixels of the input image, crops only
+#  when requested, and the number of images of the forward pass the image ran in
+#
+
+
+def encode_crop(Ilp):
+    _, png = cv2.imencode('.png', np.clip(Ilp * 255., 0, 255).astype(np.uint8))
+    return base64.b64encode(png.tobytes()).decode('ascii')
+
+
+def make_process_batch(backend, bucket_step=64):
+    def process_batch(items):
+        #
+        #  Requests with the same network input width, plate size and threshold, and whose inputs
+        #  zero-padded to multiples of bucket_step have the same size, share a forward pass
+        #
+        groups = {}
+        for i, item in enumerate(items):
+            MAXWIDTH, lp_output_resolution = vtype_parameters(item['vtype'], item['image'])
+            bucket = input_bucket(item['image'], MAXWIDTH, 2 ** 4, bucket_step)
+            groups.setdefault((MAXWIDTH, lp_output_resolution, item['threshold'], bucket), []).append(i)
+
+        results = [None] * len(items)
+        for (MAXWIDTH, lp_output_resolution, threshold, _), idxs in groups.items():
+            Is = [items[i]['image'] for i in idxs]
+            Ls, TLps, elapsed = detect_lp_width_batch(backend, Is, MAXWIDTH, 2 ** 4, lp_output_resolution, threshold,
+                                                      bucket_step=bucket_step, device=backend.device)
+            for i, L, TLp in zip(idxs, Ls, TLps):
+                plates = plates_json(L, items[i]['image'])
+                if items[i]['crops']:
+                    for plate, Ilp in zip(plates, TLp):
+                        plate['crop'] = encode_crop(Ilp)
+                results[i] = {'plates': plates, 'batch_size': len(idxs), 'network_time': elapsed}
+        return results
+    return process_batch
+
+
+def resolve_image_path(image_root, path):
+    #
+    #  Real path of an image requested by path, or None if it is outside image_root (a real path, or
+    #  None when reading by path is disabled)
+    #
+    if image_root is None or not isinstance(path, str):
+        return None
+    real_path = os.path.realpath(os.path.join(image_root, path))
+    return real_path if os.path.commonpath([real_path, image_root]) == image_root else None
+
+
+class RequestError(Exception):
+    def __init__(self, message, status=400):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class DetectionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, obj, status=200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/health':
+            return self.send_json({'error': 'not found'}, 404)
+        self.send_json({'status': 'ok', 'backend': self.server.backend_name})
+
+    def do_POST(self):
+        start = time.time()
+        url = urlparse(self.path)
+        if url.path != '/detect':
+            return self.send_json({'error': 'not found'}, 404)
+
+        try:
+            item = self.read_request(url)
+        except RequestError as e:
+            return self.send_json({'error': str(e)}, e.status)
+        try:
+            result = self.server.batcher.submit(item).result()
+        except Exception as e:
+            return self.send_json({'error': str(e)}, 500)
+        result['latency'] = time.time() - start
+        self.send_json(result)
+
+    def read_request(self, url):
+        #
+        #  Reads the image and options of a detection request, raising RequestError for invalid ones
+        #
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            raise RequestError('invalid Content-Length')
+        body = self.rfile.read(length)
+        options = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                request = json.loads(body)
+            except ValueError:
+                raise RequestError('invalid JSON body')
+            if not isinstance(request, dict):
+                raise RequestError('JSON body must be an object')
+            options.update(request)
+            if 'path' not in request:
+                raise RequestError('JSON requests must give an image path')
+            if self.server.image_root is None:
+                raise RequestError('reading images by path is disabled (see --image-root)', 403)
+            path = resolve_image_path(self.server.image_root, request['path'])
+            if path is None:
+                raise RequestError('path outside of the image root', 403)
+            I = cv2.imread(path)
+        else:
+            I = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if I is None:
+            raise RequestError('could not read image')
+
+        try:
+            threshold = float(options.get('threshold', self.server.threshold))
+        except (TypeError, ValueError):
+            threshold = None
+        if threshold is None or not np.isfinite(threshold):
+            raise RequestError('threshold must be a number')
+        vtype = options.get('vtype', self.server.vtype)
+        if not isinstance(vtype, str):
+            raise RequestError('vtype must be a string')
+        return {
+            'image': im2single(I),
+            'vtype': vtype,
+            'threshold': threshold,
+            'crops': str(options.get('crops', False)).lower() in ['1', 'true', 'yes'],
+        }
+
+
+def make_server(backend, backend_name, host='127.0.0.1', port=8080, vtype='fullimage', threshold=.35, max_batch=8,
+                max_wait=.01, bucket_step=64, image_root=None, verbose=False):
+    server = ThreadingHTTPServer((host, port), DetectionHandler)
+    server.daemon_threads = True
+    server.backend_name = backend_name
+    server.vtype = vtype
+    server.threshold = threshold
+    server.image_root = os.path.realpath(image_root) if image_root is not None else None
+    server.verbose = verbose
+    # warms up the model (first calls are much slower)
+    detect_lp_width_batch(backend, [np.zeros((256, 256, 3), dtype=np.float32)], 256, 2 ** 4, (240, 80), 1., device=backend.device)
+    server.batcher = MicroBatcher(make_process_batch(backend, bucket_step), max_batch, max_wait)
+    return server
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('-p', '--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('-b', '--backend', type=str, default='eager', choices=BACKENDS, help='Inference backend')
+    parser.add_argument('-m', '--model', type=str, default='weights/iwpodnet_retrained_epoch10000.pth', help='Model checkpoint (eager) or exported model')
+    parser.add_argument('-v', '--vtype', type=str, default='fullimage', help='Default image type (car, truck, bus, bike or fullimage)')
+    parser.add_argument('-t', '--lp_threshold', type=float, default=0.35, help='Default detection threshold')
+    parser.add_argument('--max-batch', type=int, default=8, help='Maximum number of images in a forward pass')
+    parser.add_argument('--bucket-step', type=int, default=64, help='Inputs are zero-padded to multiples of this size (multiple of 16), so that images of similar sizes share a forward pass')
+    parser.add_argument('--max-wait-ms', type=float, default=10, help='Maximum time a request waits for others to fill a batch')
+    parser.add_argument('--image-root', type=str, default=None, help='Directory of the images clients may request by path (default = reading by path disabled)')
+    parser.add_argument('--verbose', action='store_true', help='Logs every request')
+    args = parser.parse_args()
+
+    backend = load_backend(args.backend, args.model)
+    server = make_server(backend, args.backend, args.host, args.port, args.vtype, args.lp_threshold, args.max_batch,
+                         args.max_wait_ms / 1000., args.bucket_step, args.image_root, args.verbose)
+
+    print('Serving %s model on http://%s:%d' % (args.backend, args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,90 @@
+import numpy as np
+import torch
+
+from src.model import IWPODNet
+
+#
+#  Inference backends for IWPOD-NET. All backends are called like the model itself, with a float
+#  (N, 3, H, W) tensor (H and W multiples of 16) on backend.device, and return the (N, 7, H/16, W/16)
+#  output map as a torch tensor
+#
+BACKENDS = ['eager', 'torchscript', 'onnx']
+
+
+def default_device():
+    return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+
+class EagerBackend:
+    def __init__(self, weights, device=None, fuse=True):
+        self.device = torch.device(device) if device is not None else default_device()
+        self.model = IWPODNet()
+        self.model.load_state_dict(torch.load(weights, map_location=self.device)['model_state_dict'])
+        self.model.to(self.device)
+        self.model.eval()
+        if fuse:
+            self.model.fuse()
+
+    def eval(self):
+        return self
+
+    def __call__(self, inputs):
+        return self.model(inputs)
+
+
+class TorchScriptBackend:
+    #
+    #  Models saved by export.py or quantize.py. The quantized engine an int8 model was calibrated
+    #  for is stored with it, and int8 models always run on CPU
+    #
+    def __init__(self, path, device=None):
+        extra_files = {'backend': ''}
+        self.model = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+        engine = extra_files['backend']
+        if isinstance(engine, bytes):
+            engine = engine.decode()
+        if engine:
+            torch.backends.quantized.engine = engine
+            self.device = torch.device('cpu')
+        else:
+            self.device = torch.device(device) if device is not None else default_device()
+        self.model.to(self.device)
+        self.model.eval()
+
+    def eval(self):
+        return self
+
+    def __call__(self, inputs):
+        return self.model(inputs)
+
+
+class ONNXBackend:
+    #
+    #  ONNX Runtime with the CPU execution provider (onnxruntime is only required by this backend)
+    #
+    def __init__(self, path, threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads is not None:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.device = torch.device('cpu')
+
+    def eval(self):
+        return self
+
+    def __call__(self, inputs):
+        outputs = self.session.run(None, {self.input_name: np.ascontiguousarray(inputs.numpy(), dtype=np.float32)})
+        return torch.from_numpy(outputs[0])
+
+
+def load_backend(name, path, device=None, fuse=True):
+    if name == 'eager':
+        return EagerBackend(path, device, fuse)
+    if name == 'torchscript':
+        return TorchScriptBackend(path, device)
+    if name == 'onnx':
+        return ONNXBackend(path)
+    raise ValueError('Unknown backend %s (choose from %s)' % (name, ', '.join(BACKENDS)))
@@ -0,0 +1,48 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    #
+    #  Groups items submitted by concurrent callers into batches for process_batch(list of items),
+    #  which must return one result per item. A batch is processed as soon as it has max_batch items,
+    #  or max_wait seconds after its first item arrived, whichever comes first. Batches run one at a
+    #  time in a single worker thread, which is the only one using the model
+    #
+    def __init__(self, process_batch, max_batch=8, max_wait=0.01):
+        self.process_batch = process_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, item):
+        future = Future()
+        self.requests.put((item, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            items, futures = zip(*batch)
+            try:
+                results = self.process_batch(list(items))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
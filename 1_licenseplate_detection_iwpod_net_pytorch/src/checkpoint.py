@@ -0,0 +1,53 @@
+import os
+import random
+
+import numpy as np
+import torch
+
+
+def rng_state():
+    #
+    #  States of all random generators used in training (augment_sample uses NumPy and random)
+    #
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def restore_data_state(checkpoint, sampler, loader_generator):
+    #
+    #  Restores the position in the epoch (sampler), the generator drawing the seeds of DataLoader
+    #  workers and the RNG states saved in a mid-epoch checkpoint of train.py. Generator states are
+    #  CPU ByteTensors, also for CUDA generators
+    #
+    sampler.load_state_dict(checkpoint['sampler_state'])
+    loader_generator.set_state(checkpoint['loader_generator_state'].cpu())
+    set_rng_state(checkpoint['rng_state'])
+
+
+def save_checkpoint(checkpoint, path):
+    #
+    #  Writes to a temporary file and renames it, so that a crash while saving never corrupts
+    #  the previous checkpoint at path
+    #
+    tmp_path = path + '.tmp'
+    torch.save(checkpoint, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    # RNG states are CPU tensors and NumPy arrays, so checkpoints are loaded on CPU and not weights-only
+    return torch.load(path, map_location='cpu', weights_only=False)
@@ -1,12 +1,19 @@
 import os
+import random
+from collections import OrderedDict
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
 from src.utils import *
 from src.label import *
 from src.sampler import augment_sample, labels2output_map
+from src.shard import ShardReader, is_shard
 import cv2
 
-def image_label_loader(data_path):
+def image_label_loader(data_path, lazy=False):
+    #
+    #  Lists images and their annotations. In lazy mode, image paths are kept instead of the
+    #  decoded images, which are then read on demand
+    #
     Files = image_files_from_folder(data_path)
     fakepts = np.array([[0.5, 0.5001, 0.5001, 0.5], [0.5, 0.5, 0.5001, 0.5001]])
     fakeshape = Shape(fakepts)
@@ -17,12 +24,12 @@ def image_label_loader(data_path):
         if os.path.isfile(labfile):
             ann_files += 1
             L = readShapes(labfile)
-            I = cv2.imread(file)
             if len(L) > 0:
+                I = file if lazy else cv2.imread(file)
                 Data.append([I, L])
         else:
             # Appends a "fake" plate to images without any annotation
-            I = cv2.imread(file)
+            I = file if lazy else cv2.imread(file)
             Data.append([I, [fakeshape]])
 
     print('%d images with labels found' % len(Data))
@@ -30,17 +37,112 @@ def image_label_loader(data_path):
 
     return Data
 
+
+def seed_worker(worker_id):
+    #
+    #  DataLoader worker_init_fn: seeds NumPy and random (used by augment_sample) from the torch seed
+    #  of each worker, so that workers do not replicate the same augmentations
+    #
+    seed = torch.initial_seed() % 2 ** 32
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+class ResumableRandomSampler(Sampler):
+    #
+    #  Random sampler whose permutation only depends on (seed, epoch), and which can start in the
+    #  middle of an epoch, so that an interrupted training resumes with the same data order
+    #
+    def __init__(self, data_source, seed=0):
+        self.num_samples = len(data_source)
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+
+    def __iter__(self):
+        g = torch.Generator()
+        g.manual_seed(self.seed + self.epoch)
+        order = torch.randperm(self.num_samples, generator=g, device='cpu').tolist()
+        return iter(order[self.start:])
+
+    def __len__(self):
+        return self.num_samples - self.start
+
+    def state_dict(self):
+        return {'seed': self.seed, 'epoch': self.epoch, 'start': self.start}
+
+    def load_state_dict(self, state):
+        self.seed = state['seed']
+        self.set_epoch(state['epoch'], state['start'])
+
+
+class ImageCache:
+    #
+    #  LRU cache of decoded images, bounded to max_bytes (max_bytes = 0 disables caching)
+    #
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.images = OrderedDict()
+
+    def __len__(self):
+        return len(self.images)
+
+    def get(self, path):
+        I = self.images.get(path)
+        if I is not None:
+            self.images.move_to_end(path)
+            return I
+
+        I = cv2.imread(path)
+        if I is not None and I.nbytes <= self.max_bytes:
+            self.images[path] = I
+            self.nbytes += I.nbytes
+            while self.nbytes > self.max_bytes:
+                _, Iold = self.images.popitem(last=False)
+                self.nbytes -= Iold.nbytes
+        return I
+
+
 class ALPRDataset(Dataset):
-    def __init__(self, data_path, dim=208, stride=16):
+    def __init__(self, data_path, dim=208, stride=16, lazy=False, cache_mb=0, bgpool=None, roi_first=False):
+        #
+        #  lazy: decodes images on demand instead of loading all of them in memory at startup.
+        #  cache_mb: size of the LRU cache of decoded images used in lazy mode (one per DataLoader worker)
+        #  If data_path is a shard (see pack_shard.py), images are read from its memory-mapped file instead
+        #  bgpool: pool of background images used in augmentation (default pool of src.sampler if None)
+        #  roi_first: augments with the ROI-first path of augment_sample (photometric transforms on the ROI only)
+        #
         self.dim = dim
         self.stride = stride
-        self.data = image_label_loader(data_path)
+        self.bgpool = bgpool
+        self.roi_first = roi_first
+        self.lazy = lazy
+        self.cache = ImageCache(int(cache_mb * 2 ** 20))
+        self.shard = None
+        if is_shard(data_path):
+            self.shard = ShardReader(data_path)
+            self.data = [[i, L] for i, L in enumerate(self.shard.shapes)]
+            print('%d images with labels found in shard' % len(self.data))
+        else:
+            self.data = image_label_loader(data_path, lazy=lazy)
 
     def __len__(self):
         return len(self.data)
 
+    def image(self, index):
+        if self.shard is not None:
+            return self.shard.image(index)
+        I = self.data[index][0]
+        return self.cache.get(I) if self.lazy else I
+
     def __getitem__(self, index):
-        X, llp, ptslist = augment_sample(self.data[index][0], self.data[index][1], self.dim)
+        X, llp, ptslist = augment_sample(self.image(index), self.data[index][1], self.dim, bgpool=self.bgpool,
+                                         roi_first=self.roi_first)
         y = labels2output_map(llp, ptslist, self.dim, self.stride, alpha=0.5)
 
         XX = torch.from_numpy(X).permute(2, 0, 1).float()
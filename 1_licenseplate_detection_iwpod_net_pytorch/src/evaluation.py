@@ -0,0 +1,55 @@
+import os
+
+import cv2
+import numpy as np
+
+from src.label import readShapes
+from src.utils import IOU_matrix
+
+
+def evaluate_folder(files, detect, iou_threshold=.5):
+    #
+    #  Runs detect(I) -> (list of DLabel, elapsed seconds) over image files. Images with an annotation
+    #  file (same name, .txt) are used to compute recall (ground-truth plates whose bounding box has
+    #  IoU >= iou_threshold with some detection) and precision; images without annotations only count
+    #  towards the detection rate (fraction of images with at least one detected plate)
+    #
+    stats = {'images': 0, 'images_with_detections': 0, 'detections': 0, 'annotated_detections': 0,
+             'plates': 0, 'matched_plates': 0, 'true_detections': 0, 'latencies': []}
+    for file in files:
+        I = cv2.imread(file)
+        if I is None:
+            print('Skipping unreadable image %s' % file)
+            continue
+        L, elapsed = detect(I)
+        stats['images'] += 1
+        stats['images_with_detections'] += len(L) > 0
+        stats['detections'] += len(L)
+        stats['latencies'].append(elapsed)
+
+        labfile = os.path.splitext(file)[0] + '.txt'
+        if not os.path.isfile(labfile):
+            continue
+        gt = [np.array(shape.pts) for shape in readShapes(labfile)]
+        stats['plates'] += len(gt)
+        stats['annotated_detections'] += len(L)
+        if len(gt) and len(L):
+            gt_pts = np.stack(gt)
+            det_pts = np.stack([label.pts for label in L])
+            iou = IOU_matrix(gt_pts.min(2), gt_pts.max(2), det_pts.min(2), det_pts.max(2)) >= iou_threshold
+            stats['matched_plates'] += int(iou.any(1).sum())
+            stats['true_detections'] += int(iou.any(0).sum())
+    return stats
+
+
+def summary(stats):
+    latencies = 1000 * np.array(stats['latencies'] or [0.])
+    text = '%d/%d images with detections (%.1f%%), %d detections' % (
+        stats['images_with_detections'], stats['images'], 100 * stats['images_with_detections'] / max(1, stats['images']),
+        stats['detections'])
+    if stats['plates'] > 0:
+        text += ', recall %.3f, precision %.3f' % (stats['matched_plates'] / stats['plates'],
+                                                   stats['true_detections'] / max(1, stats['annotated_detections']))
+    text += ', latency mean %.2f ms, p50 %.2f ms, p95 %.2f ms' % (latencies.mean(), np.percentile(latencies, 50),
+                                                                 np.percentile(latencies, 95))
+    return text
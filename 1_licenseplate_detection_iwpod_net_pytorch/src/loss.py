@@ -36,33 +36,40 @@ def clas_loss(Ytrue, Ypred):
     return res
 
 
+#
+#  Constant tensors used by loc_loss, cached per (device, dtype)
+#
+_loc_constants = {}
+
+
+def loc_constants(device, dtype):
+    key = (device, dtype)
+    if key not in _loc_constants:
+        v = 0.5
+        # corners of the canonical square (4 corners x 3 homogeneous coordinates)
+        base = torch.tensor([[-v, -v, 1.], [v, -v, 1.], [v, v, 1.], [-v, v, 1.]], device=device, dtype=dtype)
+        # lower bounds of the 2x3 affine coefficients (scales are clamped at 0)
+        lower = torch.full((1, 2, 3, 1, 1), -float('inf'), device=device, dtype=dtype)
+        lower[0, 0, 0] = lower[0, 1, 1] = 0.
+        _loc_constants[key] = (base, lower)
+    return _loc_constants[key]
+
+
 def loc_loss(Ytrue, Ypred):
     b, h, w = Ytrue.size(0), Ytrue.size(2), Ytrue.size(3)
 
-    # device = 'cpu'
-
     obj_probs_true = Ytrue[:, 0, ...]
     affine_pred = Ypred[:, 1:, ...]
     pts_true = Ytrue[:, 1:, ...]
 
-    affinex = torch.stack([torch.clamp(affine_pred[:, 0, ...], min=0.), affine_pred[:, 1, ...], affine_pred[:, 2, ...]], 1)
-    affiney = torch.stack([affine_pred[:, 3, ...], torch.clamp(affine_pred[:, 4, ...], min=0.), affine_pred[:, 5, ...]], 1)
-
-    v = 0.5
-    base = torch.tensor([-v, -v, 1., v, -v, 1., v, v, 1., -v, v, 1.])
-    base = base.repeat(b, h, w, 1)
-    # base = base.reshape(b, -1, h, w)
-    base = base.permute(0, 3, 1, 2)
-
-    pts = torch.zeros((b, 0, h, w))
-
-    for i in range(0, 12, 3):
-        row = base[:, i:(i + 3), ...]
-        ptsx = torch.sum(affinex * row, 1)
-        ptsy = torch.sum(affiney * row, 1)
+    base, lower = loc_constants(affine_pred.device, affine_pred.dtype)
+    affine = affine_pred.reshape(b, 2, 3, h, w).clamp(min=lower)
 
-        pts_xy = torch.stack([ptsx, ptsy], 1)
-        pts = torch.cat([pts, pts_xy], 1)
+    #
+    #  Warps the four corners of the canonical square with all affine transforms at once,
+    #  giving channels (x0, y0, x1, y1, ..., y3)
+    #
+    pts = torch.einsum('bjkhw,ck->bcjhw', affine, base).reshape(b, 8, h, w)
 
     flags = obj_probs_true.view(b, 1, h, w)
     res = 1.0 * l1(pts_true * flags, pts * flags, (b, h, w, 4 * 2))
@@ -72,4 +79,9 @@ def loc_loss(Ytrue, Ypred):
 def iwpodnet_loss(Ytrue, Ypred):
     wclas = 0.5
     wloc = 0.5
-    return wloc * loc_loss(Ytrue, Ypred) + wclas * clas_loss(Ytrue, Ypred)
+    #
+    #  Always computed in fp32, also for bf16/fp16 predictions (eps of logloss is not representable in half precision)
+    #
+    with torch.autocast(device_type=Ypred.device.type, enabled=False):
+        Ytrue, Ypred = Ytrue.float(), Ypred.float()
+        return wloc * loc_loss(Ytrue, Ypred) + wclas * clas_loss(Ytrue, Ypred)
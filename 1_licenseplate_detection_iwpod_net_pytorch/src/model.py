@@ -69,3 +69,15 @@ class IWPODNet(nn.Module):
         x = self.res9(x)
         x = self.end_block(x)
         return x
+
+    def fuse(self):
+        #
+        #  Folds all BatchNorm layers into their convolutions, for faster inference. The fused model
+        #  gives the same outputs (up to rounding) in eval mode, but can no longer be trained. Fusing again
+        #  does nothing
+        #
+        self.eval()
+        for module in list(self.modules()):
+            if isinstance(module, (ConvBatch, ResBlock)):
+                module.fuse()
+        return self
@@ -1,7 +1,24 @@
+import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
 
+def fuse_conv_bn(conv, bn):
+    #
+    #  Returns a Conv2d equivalent to bn(conv(x)) in inference mode, folding the BatchNorm running
+    #  statistics and affine parameters into the convolution weights and bias
+    #
+    fused = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, stride=conv.stride,
+                      padding=conv.padding, dilation=conv.dilation, groups=conv.groups, bias=True,
+                      padding_mode=conv.padding_mode).to(conv.weight.device)
+    with torch.no_grad():
+        scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+        bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+        fused.weight.copy_(conv.weight * scale.reshape(-1, 1, 1, 1))
+        fused.bias.copy_((bias - bn.running_mean) * scale + bn.bias)
+    return fused
+
+
 class ResBlock(nn.Module):
     def __init__(self, in_channels, out_channels, filter_size=3, inner_layers=1):
         super(ResBlock, self).__init__()
@@ -17,6 +34,16 @@ class ResBlock(nn.Module):
     def forward(self, x):
         return F.relu(x + self.layers(x), inplace=True)
 
+    def fuse(self):
+        # Folds each BatchNorm into the preceding convolution (inference only; fused blocks have none left)
+        layers = []
+        for layer in self.layers:
+            if isinstance(layer, nn.BatchNorm2d):
+                layers[-1] = fuse_conv_bn(layers[-1], layer)
+            else:
+                layers.append(layer)
+        self.layers = nn.Sequential(*layers)
+
 
 class ConvBatch(nn.Module):
     def __init__(self, in_channels, out_channels, filter_size, activation='relu', padding='same', stride=(1, 1)):
@@ -32,3 +59,10 @@ class ConvBatch(nn.Module):
             return F.relu(x, inplace=True)
         else:
             return x
+
+    def fuse(self):
+        # Folds the BatchNorm into the convolution (inference only; nothing to do once fused)
+        if isinstance(self.bn, nn.Identity):
+            return
+        self.conv = fuse_conv_bn(self.conv, self.bn)
+        self.bn = nn.Identity()
@@ -0,0 +1,120 @@
+import queue
+import threading
+import time
+
+#
+#  Staged executor: each stage runs fn(item) in its own pool of threads, and stages are connected by
+#  bounded queues, so that a slow stage blocks the previous ones instead of accumulating items in
+#  memory. Threads are enough for OpenCV and PyTorch, which release the GIL in their heavy calls
+#
+_END = object()
+
+
+class Failure:
+    #
+    #  Exception raised by a stage, for the input item (as given to Pipeline.run) it was processing
+    #
+    def __init__(self, item, stage, exception):
+        self.item = item
+        self.stage = stage
+        self.exception = exception
+
+
+class Stage:
+    def __init__(self, name, fn, workers=1):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.busy = 0.       # seconds running fn, summed over workers
+        self.starved = 0.    # seconds waiting for input
+        self.blocked = 0.    # seconds waiting for room in the output queue
+        self.items = 0
+        self.lock = threading.Lock()
+
+
+class Pipeline:
+    def __init__(self, stages, queue_size=16):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.elapsed = 0.
+
+    def _worker(self, stage, q_in, q_out, finished):
+        busy = starved = blocked = 0.
+        items = 0
+        while True:
+            start = time.time()
+            entry = q_in.get()
+            starved += time.time() - start
+            if entry is _END:
+                q_in.put(_END)  # lets the other workers of the stage finish
+                break
+
+            start = time.time()
+            source, item = entry  # items travel with the input item they come from
+            if not isinstance(item, Failure):
+                try:
+                    item = stage.fn(item)
+                except Exception as e:
+                    item = Failure(source, stage.name, e)
+                items += 1
+            busy += time.time() - start
+
+            start = time.time()
+            q_out.put((source, item))
+            blocked += time.time() - start
+
+        with stage.lock:
+            stage.busy += busy
+            stage.starved += starved
+            stage.blocked += blocked
+            stage.items += items
+            finished[0] += 1
+            if finished[0] == stage.workers:
+                q_out.put(_END)
+
+    def run(self, items, yield_failures=False):
+        #
+        #  Yields the output of the last stage for each input item, in completion order (carry an
+        #  identifier in the items when order matters). Exceptions raised by a stage are re-raised here,
+        #  or with yield_failures, yielded as a Failure in place of the output of the item, and the
+        #  other items go on
+        #
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = []
+        for stage, q_in, q_out in zip(self.stages, queues[:-1], queues[1:]):
+            finished = [0]
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(target=self._worker, args=(stage, q_in, q_out, finished), daemon=True))
+
+        def feed():
+            for item in items:
+                queues[0].put((item, item))
+            queues[0].put(_END)
+        threads.append(threading.Thread(target=feed, daemon=True))
+
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        while True:
+            entry = queues[-1].get()
+            if entry is _END:
+                break
+            item = entry[1]
+            if isinstance(item, Failure) and not yield_failures:
+                raise item.exception
+            yield item
+        self.elapsed += time.time() - start
+
+    def report(self):
+        #
+        #  Occupancy of each stage: fraction of the time its workers spent running, waiting for input
+        #  (starved by the previous stage) and waiting for room in the next queue (blocked by the next
+        #  stage). The bottleneck is the stage with the highest busy fraction
+        #
+        lines = []
+        for stage in self.stages:
+            total = max(stage.workers * self.elapsed, 1e-9)
+            lines.append('%-12s %2d workers  busy %5.1f%%  starved %5.1f%%  blocked %5.1f%%  %6.2f ms/item' % (
+                stage.name, stage.workers, 100 * stage.busy / total, 100 * stage.starved / total,
+                100 * stage.blocked / total, 1000 * stage.busy / max(stage.items, 1)))
+        return '\n'.join(lines)
@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+import torch
+
+
+class Preprocessor:
+    #
+    #  Builds IWPOD-NET inputs for a stream of frames without allocating memory for each frame. For
+    #  every input size (resolution bucket) it keeps a resized image buffer, a (1, 3, h, w) float host
+    #  tensor (pinned when the device is a GPU) and a device tensor, and images are resized straight
+    #  into them from uint8, skipping the full resolution float conversion of im2single.
+    #
+    #  The returned tensor is overwritten by the next call with the same size, and a Preprocessor must
+    #  not be shared by threads
+    #
+    def __init__(self, device=None):
+        self.device = torch.device(device) if device is not None else torch.device('cpu')
+        self.buffers = {}
+        self.scale = torch.tensor(1. / 255.)
+
+    def _buffers(self, w, h, dtype):
+        key = (w, h, np.dtype(dtype).str)
+        if key not in self.buffers:
+            resized = np.empty((h, w, 3), dtype=dtype)
+            host = torch.empty((1, 3, h, w), dtype=torch.float32, pin_memory=self.device.type == 'cuda')
+            inputs = host if self.device.type == 'cpu' else torch.empty((1, 3, h, w), dtype=torch.float32, device=self.device)
+            self.buffers[key] = (resized, host, inputs)
+        return self.buffers[key]
+
+    def __call__(self, I, w, h):
+        #
+        #  Resizes I (uint8, or float in [0, 1]) to (w, h) and returns the network input tensor and the
+        #  resized image (uint8 images are scaled to [0, 1] in the tensor only)
+        #
+        resized, host, inputs = self._buffers(w, h, I.dtype)
+        cv2.resize(I, (w, h), dst=resized, interpolation=cv2.INTER_CUBIC)
+        host[0].copy_(torch.from_numpy(resized).permute(2, 0, 1))
+        if I.dtype == np.uint8:
+            host.mul_(self.scale)
+        if inputs is not host:
+            inputs.copy_(host, non_blocking=True)
+        return inputs, resized
@@ -0,0 +1,69 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+#
+#  Timing helpers of the benchmark scripts: a StageTimer collects the durations of named stages
+#  (one entry per call), and latency_summary turns them into percentiles
+#
+PERCENTILES = (50, 95, 99)
+
+
+def latency_summary(seconds):
+    #
+    #  Count, total, mean and percentiles (in milliseconds) of a list of durations in seconds
+    #
+    ms = 1000 * np.asarray(seconds, dtype=float)
+    if len(ms) == 0:
+        return {'count': 0, 'total_ms': 0., 'mean_ms': 0., **{'p%d_ms' % p: 0. for p in PERCENTILES}}
+    summary = {'count': len(ms), 'total_ms': float(ms.sum()), 'mean_ms': float(ms.mean())}
+    summary.update({'p%d_ms' % p: float(np.percentile(ms, p)) for p in PERCENTILES})
+    return summary
+
+
+class StageTimer:
+    #
+    #  Durations of each stage, in insertion order of the stage names. Safe to share between threads
+    #
+    def __init__(self):
+        self.times = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.times.setdefault(name, []).append(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def wrap(self, name, fn):
+        #
+        #  fn, timing each of its calls as stage name
+        #
+        def timed(*args, **kwargs):
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        return timed
+
+    def summary(self):
+        return {name: latency_summary(times) for name, times in self.times.items()}
+
+    def report(self, total=None):
+        #
+        #  One line per stage; with total (seconds), also the share of each stage in it
+        #
+        lines = []
+        for name, s in self.summary().items():
+            line = '%-20s %6d calls  mean %8.3f ms  p50 %8.3f ms  p95 %8.3f ms  p99 %8.3f ms' % (
+                name, s['count'], s['mean_ms'], s['p50_ms'], s['p95_ms'], s['p99_ms'])
+            if total:
+                line += '  %5.1f%%' % (100 * s['total_ms'] / 1000 / total)
+            lines.append(line)
+        return '\n'.join(lines)
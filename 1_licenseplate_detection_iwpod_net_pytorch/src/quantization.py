@@ -0,0 +1,49 @@
+import copy
+
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+#
+#  Post-training static int8 quantization of IWPOD-NET (FX graph mode, CPU only). Conv + BatchNorm
+#  (+ ReLU) and the residual add + ReLU are fused by prepare_fx; the last convolution of each head,
+#  the sigmoid and the final concatenation stay in fp32, since probabilities and affine parameters
+#  have very different ranges and would otherwise share a single output scale
+#
+FP32_MODULES = ['end_block.prob_conv3', 'end_block.bbox_conv3']
+
+
+def quantize_model(model, calibration_inputs, backend='x86'):
+    #
+    #  Returns an int8 copy of model, calibrated on an iterable of (1, 3, H, W) input tensors
+    #
+    torch.backends.quantized.engine = backend
+    qconfig_mapping = get_default_qconfig_mapping(backend)
+    for name in FP32_MODULES:
+        qconfig_mapping.set_module_name(name, None)
+    qconfig_mapping.set_object_type(torch.sigmoid, None)
+    qconfig_mapping.set_object_type(torch.cat, None)
+
+    model = copy.deepcopy(model).cpu().eval()
+    example_inputs = None
+    prepared = None
+    with torch.no_grad():
+        for inputs in calibration_inputs:
+            if prepared is None:
+                example_inputs = (inputs,)
+                prepared = prepare_fx(model, qconfig_mapping, example_inputs)
+            prepared(inputs)
+    assert prepared is not None, 'calibration set is empty'
+
+    return convert_fx(prepared), example_inputs
+
+
+def save_quantized(qmodel, example_inputs, path, backend='x86'):
+    #
+    #  Saves the quantized model as TorchScript (input height and width remain dynamic), together with
+    #  the quantization backend it was calibrated for (models are loaded with src.backends.TorchScriptBackend)
+    #
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.trace(qmodel, example_inputs))
+    torch.jit.save(scripted, path, _extra_files={'backend': backend})
+
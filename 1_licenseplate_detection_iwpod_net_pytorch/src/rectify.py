@@ -0,0 +1,103 @@
+import cv2
+import numpy as np
+
+#
+#  Batched plate rectification. Homographies mapping each plate quadrilateral (corners in pixels, in
+#  the order top-left, top-right, bottom-right, bottom-left) to the out_size rectangle are solved in
+#  closed form for all plates at once (h33 = 1, one 8x8 linear system per plate), instead of an SVD
+#  of the 8x9 system of projection_utils.find_T_matrix for each plate
+#
+ROI_MARGIN = 3  # pixels around the plate read by the interpolation kernels
+
+
+def plate_homographies(quads, out_size):
+    #
+    #  Returns (N, 3, 3) homographies from the image to the plates, for quads given as a (N, 2, 4) array
+    #
+    quads = np.asarray(quads, dtype=float)
+    n = len(quads)
+    w, h = out_size
+    u = np.array([0., w, w, 0.])
+    v = np.array([0., 0., h, h])
+    x, y = quads[:, 0], quads[:, 1]
+    zeros, ones = np.zeros_like(x), np.ones_like(x)
+
+    #
+    #  Rows [x y 1 0 0 0 -ux -uy] h = u and [0 0 0 x y 1 -vx -vy] h = v for each corner
+    #
+    A = np.empty((n, 8, 8))
+    A[:, 0::2] = np.stack((x, y, ones, zeros, zeros, zeros, -u * x, -u * y), 2)
+    A[:, 1::2] = np.stack((zeros, zeros, zeros, x, y, ones, -v * x, -v * y), 2)
+    b = np.empty((n, 8))
+    b[:, 0::2] = u
+    b[:, 1::2] = v
+
+    try:
+        H = np.linalg.solve(A, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        # degenerate quadrilaterals (e.g. collinear corners) get least-squares solutions
+        H = np.stack([np.linalg.lstsq(A[i], b[i], rcond=None)[0] for i in range(n)])
+    return np.concatenate((H, np.ones((n, 1))), 1).reshape((n, 3, 3))
+
+
+def auto_interpolation(quad, out_size):
+    #
+    #  Bicubic when the plate is enlarged, bilinear when it is reduced (where bicubic only costs more)
+    #
+    x, y = quad
+    area = .5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+    return cv2.INTER_CUBIC if area < out_size[0] * out_size[1] else cv2.INTER_LINEAR
+
+
+def rectify_plates(I, quads, out_size, interpolation=cv2.INTER_CUBIC, roi_first=False, out=None):
+    #
+    #  Warps every plate of image I to out_size (w, h). interpolation is an OpenCV flag, or 'auto' to
+    #  choose it for each plate from its size (auto_interpolation). With roi_first, only the bounding
+    #  region of each plate (plus a small margin) is given to warpPerspective. When out is given (an
+    #  array with room for at least len(quads) plates, of I's dtype), plates are warped into it and the
+    #  returned plates are views of out
+    #
+    quads = np.asarray(quads, dtype=float)
+    if len(quads) == 0:
+        return []
+    Hs = plate_homographies(quads, out_size)
+    height, width = I.shape[:2]
+
+    plates = []
+    for i, (quad, H) in enumerate(zip(quads, Hs)):
+        flags = auto_interpolation(quad, out_size) if interpolation == 'auto' else interpolation
+        src = I
+        if roi_first:
+            x0, y0 = np.maximum(np.floor(quad.min(1)) - ROI_MARGIN, 0).astype(int)
+            x1, y1 = np.minimum(np.ceil(quad.max(1)) + ROI_MARGIN + 1, (width, height)).astype(int)
+            if x1 > x0 and y1 > y0:
+                src = I[y0:y1, x0:x1]
+                H = H @ np.array([[1., 0., x0], [0., 1., y0], [0., 0., 1.]])  # ROI to image coordinates first
+        dst = out[i] if out is not None else None
+        plates.append(cv2.warpPerspective(src, H, out_size, dst=dst, flags=flags, borderValue=.0))
+    return plates
+
+
+class Rectifier:
+    #
+    #  rectify_plates with output buffers kept between calls (plates are then overwritten by the next
+    #  call), for a stream of images of the same type
+    #
+    def __init__(self, out_size, interpolation='auto', roi_first=True, reuse_buffers=True):
+        self.out_size = out_size
+        self.interpolation = interpolation
+        self.roi_first = roi_first
+        self.reuse_buffers = reuse_buffers
+        self.buffer = None
+
+    def __call__(self, I, quads):
+        out = None
+        if self.reuse_buffers and len(quads):
+            w, h = self.out_size
+            shape = (h, w) + I.shape[2:]
+            if self.buffer is None or self.buffer.shape[1:] != shape or self.buffer.dtype != I.dtype:
+                self.buffer = np.empty((max(len(quads), 8),) + shape, dtype=I.dtype)
+            elif len(self.buffer) < len(quads):
+                self.buffer = np.empty((2 * len(quads),) + shape, dtype=I.dtype)
+            out = self.buffer
+        return rectify_plates(I, quads, self.out_size, self.interpolation, self.roi_first, out)
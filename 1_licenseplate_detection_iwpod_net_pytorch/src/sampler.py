@@ -1,7 +1,9 @@
+import os
 import cv2
 import numpy as np
 import random
 import glob
+from functools import lru_cache
 
 from .utils import im2single, getWH, hsv_transform
 from .label	import Label
@@ -11,31 +13,98 @@ from .projection_utils import perspective_transform, find_T_matrix, getRectPts
 #  Use UseBG if you want to pad distorted images with bakcground data
 #
 UseBG = True
-bgimages = []
 dim0 = 208
-BGDataset = 'bgimages\\'  # directory with background images using to pad images in data augmentation
+BGDataset = 'bgimages'  # directory with background images using to pad images in data augmentation
+
+
+class BackgroundPool:
+	#
+	#  Pool of background images used to pad distorted images. Images are only loaded on first use,
+	#  and are kept as uint8 in a single buffer; only the random crops are converted to float.
+	#
+	#  If mmap_path is given, the buffer is saved to that file the first time and memory-mapped
+	#  afterwards, so that all DataLoader workers (even with the spawn start method) share its pages.
+	#  Otherwise, loading the pool before starting the workers shares it through fork
+	#
+	def __init__(self, directory=BGDataset, min_side=dim0, mmap_path=None):
+		self.directory = directory
+		self.min_side = min_side
+		self.mmap_path = mmap_path
+		self.images = None
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		if self.mmap_path is not None:
+			state['images'] = None  # maps the file again instead of copying it
+		return state
+
+	def __len__(self):
+		return len(self.load().images)
+
+	def load(self):
+		if self.images is not None:
+			return self
+		if self.mmap_path is not None and os.path.isfile(self.mmap_path + '.shapes.npy'):
+			buffer = np.memmap(self.mmap_path, dtype=np.uint8, mode='r')
+			shapes = np.load(self.mmap_path + '.shapes.npy')
+		else:
+			buffer, shapes = self.read_directory()
+			if self.mmap_path is not None and len(shapes):
+				buffer.tofile(self.mmap_path + '.tmp')
+				os.replace(self.mmap_path + '.tmp', self.mmap_path)
+				np.save(self.mmap_path + '.shapes.npy', shapes)
+				buffer = np.memmap(self.mmap_path, dtype=np.uint8, mode='r')
+
+		#
+		#  Images are views of the single buffer
+		#
+		self.images = []
+		offset = 0
+		for shape in shapes:
+			size = int(np.prod(shape))
+			self.images.append(buffer[offset:offset + size].reshape(shape))
+			offset += size
+		return self
+
+	def read_directory(self):
+		#
+		#  Reads all BG images, resizing them so that their smallest side is at least min_side
+		#
+		imgs = []
+		for im in sorted(glob.glob(os.path.join(self.directory, '*.jpg'))):
+			img = cv2.imread(im)
+			factor = max(1, self.min_side/min(img.shape[0:2]))
+			imgs.append(cv2.resize(img, (0,0), fx = factor, fy = factor))
+		shapes = np.array([img.shape for img in imgs], dtype=np.int64).reshape((-1, 3))
+		buffer = np.concatenate([img.reshape(-1) for img in imgs]) if len(imgs) else np.zeros(0, dtype=np.uint8)
+		return buffer, shapes
+
+	def random_crop(self, width, height, dtype='float32'):
+		#
+		#  Random crop of a random BG image, in [0,1] for float dtypes
+		#
+		self.load()
+		bgimage = self.images[int(np.random.rand()*len(self.images))]
+		crop = random_crop(bgimage, width, height)
+		if dtype == 'uint8':
+			return crop.copy()
+		return crop.astype(dtype)/255
 
 
 #
-# Creates list with BG images
+# Default pool of BG images
 #
-if UseBG:
-	imglist = glob.glob(BGDataset + '*.jpg')
-	for im in imglist:
-		img = cv2.imread(im)
-		factor = max(1, dim0/min(img.shape[0:2]))
-		img = cv2.resize(img, (0,0), fx = factor, fy = factor).astype('float32')/255
-		bgimages.append(img)
+default_bgpool = BackgroundPool()
+
 
-	
 def random_crop(img, width, height):
 	#
 	#  generates random crop of img with desired size
 	#
 	or_height = img.shape[0]
 	or_width = img.shape[1]
-	top = int(np.random.rand(1)*(or_height - height))
-	bottom = int(np.random.rand(1)*(or_width - width))
+	top = int(np.random.rand()*(or_height - height))
+	bottom = int(np.random.rand()*(or_width - width))
 	crop = img[top:(top+height), bottom:(bottom+width),:]
 	return crop
 
@@ -58,14 +127,12 @@ def ShrinkQuadrilateral(pts, alpha=0.75):
 
 def LinePolygonEdges(pts):
 	#
-	# Finds the line equations of the polygon edges (given the verices in clockwise order)
+	# Finds the line equations of the polygon edges (given the verices in clockwise order).
+	#  Returns a (4,3) array, one line per edge
 	#
-	lines = []
-	for i in range(4):
-		x1 = np.hstack((pts[:, i], 1))
-		x2 = np.hstack((pts[:, (i + 1) % 4], 1))
-		lines.append(np.cross(x1, x2))
-	return lines
+	x1 = np.vstack((pts, np.ones((1, 4)))).T
+	x2 = np.roll(x1, -1, axis=0)
+	return np.cross(x1, x2)
 
 
 def insidePolygon(pt, lines):
@@ -87,6 +154,18 @@ def insidePolygon(pt, lines):
 	return output
 
 
+@lru_cache(maxsize=None)
+def output_cell_centers(dim, stride):
+	#
+	#  Centers (x + .5, y + .5) of all cells of the output map, as a (outsize, outsize, 2) array
+	#
+	outsize = int(dim / stride)
+	y, x = np.mgrid[0:outsize, 0:outsize]
+	centers = np.stack((x + .5, y + .5), 2)
+	centers.flags.writeable = False
+	return centers
+
+
 def labels2output_map(labelist, lpptslist, dim, stride, alpha=0.75):
 	#
 	#  Generates outpmut map with binary (classification) labels and quadrilateral corners (regression)
@@ -140,30 +219,24 @@ def labels2output_map(labelist, lpptslist, dim, stride, alpha=0.75):
 		lines = LinePolygonEdges(pts2);
 		
 		#
-		#  Scans LP bounding box and triggers a classification label if point is inside
-		#  shrunk LP
-		#
-		for x in range(tlx, brx):
-			for y in range(tly, bry):
-
-				mn = np.array([float(x) + .5, float(y) + .5])		
-				#
-				#  Tests if current point is inside shrunk LP
-				#				
-				if insidePolygon(mn, lines):				
-					#
-					#  Translates LP points to the cell center
-					#
-					p_MN_center_mn = p_MN - mn.reshape((2, 1))					
-					#
-					#  Re-scales according to avergate LP side 
-					#
-					p_side = p_MN_center_mn / side
-					#
-					#  Defines classification label and re-scaled LP locations to be regressed
-					#
-					Y[y, x, 0] = 1.
-					Y[y, x, 1:] = p_side.T.flatten()
+		#  Tests all cells of the LP bounding box against the edges of the shrunk LP at once,
+		#  and triggers a classification label for cells inside it
+		#
+		mn = output_cell_centers(dim, stride)[tly:bry, tlx:brx].reshape((-1, 2))
+		sigs = mn[:, 0:1] * lines[:, 0] + mn[:, 1:2] * lines[:, 1] + lines[:, 2]
+		mn = mn[~(sigs < 0).any(1)]
+		if len(mn):
+			#
+			#  Translates LP points to the cell centers, and re-scales according to avergate LP side
+			#
+			p_MN_center_mn = np.asarray(p_MN).reshape((1, 2, 4)) - mn.reshape((-1, 2, 1))
+			p_side = p_MN_center_mn / side
+			#
+			#  Defines classification labels and re-scaled LP locations to be regressed
+			#
+			x, y = (mn - .5).astype(int).T
+			Y[y, x, 0] = 1.
+			Y[y, x, 1:] = p_side.transpose((0, 2, 1)).reshape((-1, 8))
 		#
 		#  Always set a true label at centroid if not fake LP (first test)
 		#
@@ -210,11 +283,13 @@ def project(I, T, pts, dim):
 	return Iroi, ptsret
 
 
-def project_all(I, T, ptslist, dim, bgimages = bgimages):
+def project_all(I, T, ptslist, dim, bgpool = None, negate = False, blur_sigma = None):
 	#
-	#  Warps image I to desired dimensions using matrix T. if bgimage is not empty,
-	#  completes with background
+	#  Warps image I to desired dimensions using matrix T. if bgpool (default pool if None)
+	#  is not empty, completes with background
 	#  Also projects LP coordinates given in ptslist to keep coherence
+	#  If negate, returns the negative of the warped image (but not of the background)
+	#  If blur_sigma, the warped image (but not the background) is blurred with that standard deviation
 	#
 	#
 	outptslist = []
@@ -229,23 +304,46 @@ def project_all(I, T, ptslist, dim, bgimages = bgimages):
 		ptsret = ptsret / dim
 		outptslist.append(np.array(ptsret))
 	#
-	#  Warps input image (possibly padding with BG images)
-	#
-	Iroi = cv2.warpPerspective(I, T, (dim, dim), borderValue=(.5,.5,.5), flags=cv2.INTER_CUBIC)
-	if len(bgimages) > 0:
-		bgimage = bgimages[int(np.random.rand()*len(bgimages))]
-		bgimage = random_crop(bgimage, dim, dim)
-		bw = np.ones(I.shape)
-		bw = cv2.warpPerspective(bw, T, (dim, dim), borderValue= (0, 0, 0), flags=cv2.INTER_LINEAR)
-		Iroi[bw == 0] = bgimage[bw == 0]
+	#  Warps input image (possibly padding with BG images). A BG crop is used as destination of
+	#  the warp with transparent borders: pixels mapped from outside I keep the background (and
+	#  blend with it at the image boundary), in a single pass at output resolution
+	#
+	maxval = 255 if I.dtype == 'uint8' else 1.
+	if bgpool is None:
+		bgpool = default_bgpool if UseBG else []
+	if len(bgpool) > 0:
+		Iroi = bgpool.random_crop(dim, dim, dtype=I.dtype)
+		if negate:
+			Iroi = maxval - Iroi  # negated twice, BG is kept
+		cv2.warpPerspective(I, T, (dim, dim), dst=Iroi, flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_TRANSPARENT)
+	else:
+		gray = .5*maxval
+		Iroi = cv2.warpPerspective(I, T, (dim, dim), borderValue=(gray,gray,gray), flags=cv2.INTER_CUBIC)
+	if blur_sigma is not None:
+		#
+		#  As for a blurred source image, the background stays sharp: the warp of I is blurred (with the
+		#  borders of I replicated) and replaces the pixels mapped from inside I only
+		#
+		Iwarp = cv2.warpPerspective(I, T, (dim, dim), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+		inside = cv2.warpPerspective(np.ones(I.shape[:2], dtype=np.uint8), T, (dim, dim), flags=cv2.INTER_NEAREST)
+		np.copyto(Iroi, randomblur(Iwarp, blur_sigma), where=inside[..., None] > 0)
+	if negate:
+		Iroi = maxval - Iroi
 	return Iroi, outptslist
 
-def randomblur(img):
+def random_blur_sigma(shape):
 	#
-	#  Applies random blur to image
+	#  Draws the standard deviation of a random blur for an image with dimensions shape
 	#
-	maxblur = np.min(img.shape)/10
-	sig = abs(np.random.normal(0, .1))*maxblur
+	maxblur = np.min(shape)/10
+	return abs(np.random.normal(0, .1))*maxblur
+
+def randomblur(img, sig = None):
+	#
+	#  Applies random blur to image (with standard deviation sig, drawn if None)
+	#
+	if sig is None:
+		sig = random_blur_sigma(img.shape)
 	ksize = 2*int(0.5 + 2*sig) + 1
 	out =  cv2.GaussianBlur(img, (ksize, ksize), sig)
 	return out
@@ -272,11 +370,23 @@ def flip_image_and_pts(I, pts):
 	return I, pts
 
 
-def augment_sample(I, shapelist, dim, maxangle = 2 * np.array([65.,65.,55.]), maxsum = 140):
+def polygon_area(pts):
+	#
+	#  Area of a polygon with vertices pts (2 x N), using the shoelace formula
+	#
+	x, y = np.asarray(pts)
+	return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))/2
+
+
+def augment_sample(I, shapelist, dim, maxangle = 2 * np.array([65.,65.,55.]), maxsum = 140, bgpool = None, roi_first = False):
 	#
 	#  Main augmentation function. Generates an augmented version
 	#  of input image I and the corresponding LP corners given in shapelist
 	#
+	#  If roi_first, the source image is never converted to float: the uint8 image is warped (or
+	#  cropped) first, and photometric transforms (negative, blur) are applied to the dim x dim ROI only,
+	#  with the blur rescaled to the ROI resolution. Random draws are the same as in the original path
+	#
 	
 	#
 	#  Input is image I, list of shape elements (shape), and input dim
@@ -305,18 +415,23 @@ def augment_sample(I, shapelist, dim, maxangle = 2 * np.array([65.,65.,55.]), ma
 	#
 	# Normalizes intensities to [0,1]
  	#	
-	I = im2single(I)
+	if not roi_first:
+		I = im2single(I)
 	#
 	#  Possible negative of the image
 	#
-	if np.random.uniform(0,1) < 0.05:
+	negate = np.random.uniform(0,1) < 0.05
+	if negate and not roi_first:
 		I = 1 - I;
 	
 	#
 	# Possible blur
 	#	
-	if np.random.rand() < 0.15:
-		I = randomblur(I)
+	blur = np.random.rand() < 0.15
+	if blur:
+		sig = random_blur_sigma(I.shape)
+		if not roi_first:
+			I = randomblur(I, sig)
 	
 	
 	#
@@ -382,10 +497,22 @@ def augment_sample(I, shapelist, dim, maxangle = 2 * np.array([65.,65.,55.]), ma
 		#
 		H = np.matmul(H,T)
 
+		#
+		#  In roi_first, the blur is applied to the warped image (not to the background), rescaled by
+		#  the change of the LP scale from the source image to the ROI
+		#
+		blur_sigma = None
+		if roi_first and blur:
+			ptsh = np.matmul(H, np.concatenate((pts, np.ones((1, 4))), 0))
+			scale = np.sqrt(polygon_area(ptsh[:2]/ptsh[2])/max(polygon_area(pts), 1e-6))
+			blur_sigma = sig*scale
+
 		#
 		# projects images and labels according to 3D rotation
 		#
-		Iroi, ptslist = project_all(I, H, ptslist, dim)
+		Iroi, ptslist = project_all(I, H, ptslist, dim, bgpool, negate = negate and roi_first, blur_sigma = blur_sigma)
+		if roi_first:
+			Iroi = im2single(Iroi)
 		pts = ptslist[0]
 	else:  # if fake plate
 		#
@@ -393,8 +520,15 @@ def augment_sample(I, shapelist, dim, maxangle = 2 * np.array([65.,65.,55.]), ma
 		#	
 		rfactorx = max(dim/I.shape[0],  0.5 + 0.5*np.random.rand())
 		rfactory = max(rfactorx, dim/I.shape[1])
-		Iroi = cv2.resize(I, (0,0), fx = rfactorx, fy = rfactory)
+		if not roi_first:
+			Iroi = cv2.resize(I, (0,0), fx = rfactorx, fy = rfactory)
 		Iroi = random_crop(I, dim, dim)
+		if roi_first:
+			Iroi = im2single(Iroi)
+			if negate:
+				Iroi = 1 - Iroi
+			if blur:
+				Iroi = randomblur(Iroi, sig)
 		
 	#
 	#	Just a sanity check, test should never hold
@@ -0,0 +1,108 @@
+import os
+
+import cv2
+import numpy as np
+
+from src.label import Shape
+
+#
+#  A shard is a directory with all training images stored as raw uint8 arrays in a single file
+#  (memory-mapped when reading), and an index with their offsets, dimensions and annotations
+#
+SHARD_IMAGES = 'images.bin'
+SHARD_INDEX = 'index.npz'
+
+
+def is_shard(path):
+    return os.path.isfile(os.path.join(path, SHARD_INDEX))
+
+
+def write_shard(data, shard_dir):
+    #
+    #  Packs a list of [image path, list of shapes] (as given by image_label_loader in lazy mode)
+    #  into shard_dir
+    #
+    if not os.path.isdir(shard_dir):
+        os.makedirs(shard_dir)
+
+    offsets, image_shapes, paths = [], [], []
+    shape_counts, npts, pts, texts = [], [], [], []
+    offset = 0
+    with open(os.path.join(shard_dir, SHARD_IMAGES), 'wb') as fp:
+        for path, L in data:
+            I = cv2.imread(path)
+            if I is None:
+                print('Skipping unreadable image %s' % path)
+                continue
+            I = np.ascontiguousarray(I)
+            fp.write(I.tobytes())
+
+            offsets.append(offset)
+            image_shapes.append(I.shape)
+            paths.append(path)
+            offset += I.nbytes
+
+            shape_counts.append(len(L))
+            for shape in L:
+                npts.append(shape.pts.shape[1])
+                pts.append(np.asarray(shape.pts, dtype=float))
+                texts.append(shape.text)
+
+    np.savez(os.path.join(shard_dir, SHARD_INDEX),
+             offsets=np.array(offsets, dtype=np.int64).reshape(-1),
+             image_shapes=np.array(image_shapes, dtype=np.int64).reshape((-1, 3)),
+             paths=np.array(paths, dtype=str),
+             shape_counts=np.array(shape_counts, dtype=np.int64),
+             npts=np.array(npts, dtype=np.int64),
+             pts=np.concatenate(pts, 1) if len(pts) else np.zeros((2, 0)),
+             texts=np.array(texts, dtype=str))
+
+    print('%d images (%.1f MB) packed into %s' % (len(offsets), offset / 2 ** 20, shard_dir))
+    return len(offsets)
+
+
+class ShardReader:
+    #
+    #  Reads images of a shard as zero-copy (read-only) views of a memory-mapped file, so that
+    #  processes reading the same shard share pages through the OS cache. The file is only mapped
+    #  on first access, so that each DataLoader worker maps it instead of receiving a pickled copy
+    #
+    def __init__(self, shard_dir):
+        self.shard_dir = shard_dir
+        with np.load(os.path.join(shard_dir, SHARD_INDEX)) as index:
+            self.offsets = index['offsets']
+            self.image_shapes = index['image_shapes']
+            self.paths = index['paths']
+            shape_counts = index['shape_counts']
+            npts = index['npts']
+            pts = index['pts']
+            texts = index['texts']
+
+        #
+        #  Rebuilds the list of shapes of each image
+        #
+        self.shapes = []
+        pt_starts = np.concatenate(([0], np.cumsum(npts)))
+        first = 0
+        for count in shape_counts:
+            L = []
+            for k in range(first, first + count):
+                L.append(Shape(pts[:, pt_starts[k]:pt_starts[k + 1]].copy(), text=str(texts[k])))
+            self.shapes.append(L)
+            first += count
+        self._images = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_images'] = None
+        return state
+
+    def image(self, index):
+        if self._images is None:
+            self._images = np.memmap(os.path.join(self.shard_dir, SHARD_IMAGES), dtype=np.uint8, mode='r')
+        h, w, c = self.image_shapes[index]
+        offset = self.offsets[index]
+        return self._images[offset:offset + h * w * c].reshape((h, w, c))
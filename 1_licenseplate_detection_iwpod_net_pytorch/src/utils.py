@@ -101,21 +101,20 @@ def IOU_centre_and_dims(cc1,wh1,cc2,wh2):
 	return IOU(cc1-wh1/2.,cc1+wh1/2.,cc2-wh2/2.,cc2+wh2/2.)
 
 
-def nms_darkflow(Labels, iou_threshold=.5):
-	SelectedLabels = []
-	Labels.sort(key=lambda l: l['confidence'], reverse=True)
-
-	for label in Labels:
-		non_overlap = True
-		for sel_label in SelectedLabels:
-			if IOU_labels_darkflow(label, sel_label) > iou_threshold:
-				non_overlap = False
-				break
+def darkflow_boxes(Labels):
+	#
+	#  Corners and confidences of a list of darkflow detections, as arrays for nms_boxes
+	#
+	tl = np.array([[l['topleft']['x'], l['topleft']['y']] for l in Labels], dtype=float).reshape((-1, 2))
+	br = np.array([[l['bottomright']['x'], l['bottomright']['y']] for l in Labels], dtype=float).reshape((-1, 2))
+	scores = np.array([l['confidence'] for l in Labels], dtype=float)
+	return tl, br, scores
 
-		if non_overlap:
-			SelectedLabels.append(label)
 
-	return SelectedLabels
+def nms_darkflow(Labels, iou_threshold=.5):
+	Labels.sort(key=lambda l: l['confidence'], reverse=True)
+	keep = nms_boxes(*darkflow_boxes(Labels), iou_threshold=iou_threshold)
+	return [Labels[i] for i in keep]
 
 
 #
@@ -208,36 +207,17 @@ def get_bike_string_brazil(ocr):
 #  with a default threshold (0.4). If number of detections outside the range, increases or decrases effective threshold	
 #
 def nms_darkflow_range(Labels, iou_threshold =.25, min_threshold = 0.4, min_characters = 0, max_characters = np.inf):
-	SelectedLabels = []
 	#
 	#  Sorts detection in descending order of confidence
 	#
 	Labels.sort(key=lambda l: l['confidence'], reverse=True)
 	#
-	#  Finds labels with small IoU
+	#  Finds labels with small IoU, stopping if minumum number is reached and ocr confidence is low,
+	#  or if maximum number is reached
 	#
-	for label in Labels:
-		non_overlap = True
-		for sel_label in SelectedLabels:
-			if IOU_labels_darkflow(label, sel_label) > iou_threshold:
-				non_overlap = False
-				break
-		if non_overlap:
-			SelectedLabels.append(label)
-#			print(label)
-
-		#
-		#  Stops if minumum number is reached and ocr confidence is low
-		#
-		if len(SelectedLabels) > min_characters and SelectedLabels[-1]['confidence'] < min_threshold:
-			del(SelectedLabels[-1])
-			break
-		#
-		#  Stops if maximum number is reached
-		#
-		if len(SelectedLabels) == max_characters:
-			break
-	return SelectedLabels
+	keep = nms_boxes(*darkflow_boxes(Labels), iou_threshold=iou_threshold, min_threshold=min_threshold,
+					 min_count=min_characters, max_count=max_characters)
+	return [Labels[i] for i in keep]
 
 
 
@@ -245,29 +225,16 @@ def nms_darkflow_range(Labels, iou_threshold =.25, min_threshold = 0.4, min_char
 #  NMS with target number of characters
 #
 def nms_darkflow_target(Labels, iou_threshold =.25, target_characters = np.inf):
-	SelectedLabels = []
 	#
 	#  Sorts detection in descending order of confidence
 	#
 	Labels.sort(key=lambda l: l['confidence'], reverse=True)
 	
 	#
-	#  Finds labels with small IoU
+	#  Finds labels with small IoU, stopping when number of characters is reached
 	#
-	for label in Labels:
-		non_overlap = True
-		for sel_label in SelectedLabels:
-			if IOU_labels_darkflow(label, sel_label) > iou_threshold:
-				non_overlap = False
-				break
-		if non_overlap:
-			SelectedLabels.append(label)
-		#
-		#  Stops when number of characters is reached
-		#
-		if len(SelectedLabels) ==  target_characters:
-			break
-	return SelectedLabels
+	keep = nms_boxes(*darkflow_boxes(Labels), iou_threshold=iou_threshold, max_count=target_characters)
+	return [Labels[i] for i in keep]
 
 def generate_bb_yolo(ocr_entry, width = 240, height = 80):
 	#
@@ -283,20 +250,71 @@ def generate_bb_yolo(ocr_entry, width = 240, height = 80):
 
 def nms(Labels,iou_threshold=.5):
 
-	SelectedLabels = []
 	Labels.sort(key=lambda l: l.prob(),reverse=True)
 
-	for label in Labels:
-		non_overlap = True
-		for sel_label in SelectedLabels:
-			if IOU_labels(label,sel_label) > iou_threshold:
-				non_overlap = False
-				break
+	tl = np.array([l.tl() for l in Labels], dtype=float).reshape((-1, 2))
+	br = np.array([l.br() for l in Labels], dtype=float).reshape((-1, 2))
+	scores = np.array([l.prob() for l in Labels], dtype=float)
+	keep = nms_boxes(tl, br, scores, iou_threshold)
 
-		if non_overlap:
-			SelectedLabels.append(label)
+	return [Labels[i] for i in keep]
 
-	return SelectedLabels
+
+def IOU_matrix(tl1, br1, tl2, br2):
+	#
+	#  IoU between every box in (tl1,br1) and every box in (tl2,br2), given as (N,2) arrays
+	#  of corners. Returns a (N1,N2) matrix
+	#
+	intersection_wh = np.maximum(np.minimum(br1[:, None], br2[None]) - np.maximum(tl1[:, None], tl2[None]), 0.)
+	intersection_area = np.prod(intersection_wh, 2)
+	area1, area2 = np.prod(br1 - tl1, 1), np.prod(br2 - tl2, 1)
+	union_area = area1[:, None] + area2[None] - intersection_area
+	with np.errstate(divide='ignore', invalid='ignore'):
+		return intersection_area / union_area
+
+
+def nms_boxes(tl, br, scores, iou_threshold=.5, min_threshold=-np.inf, min_count=0, max_count=np.inf, block_size=256):
+	#
+	#  Greedy NMS engine over arrays of boxes. tl and br are (N,2) arrays with the top-left and
+	#  bottom-right corners, and scores is a (N,) array. Returns the indices of the selected
+	#  boxes in descending order of score.
+	#
+	#  Stops when max_count boxes are selected, or when more than min_count boxes are selected
+	#  and the last one has score lower than min_threshold (which is then discarded).
+	#
+	#  Boxes are processed in blocks of block_size: IoUs of a block against the previously
+	#  selected boxes and inside the block are computed as matrices, so that only the
+	#  (sequential) greedy selection runs in Python
+	#
+	scores = np.asarray(scores, dtype=float)
+	order = np.argsort(-scores, kind='stable')
+	tl, br, scores = np.asarray(tl, dtype=float)[order], np.asarray(br, dtype=float)[order], scores[order]
+
+	keep = []
+	for start in range(0, len(order), block_size):
+		stop = min(start + block_size, len(order))
+		btl, bbr = tl[start:stop], br[start:stop]
+
+		#
+		#  Discards boxes of the block overlapping boxes selected in previous blocks
+		#
+		alive = np.ones(stop - start, dtype=bool)
+		if len(keep):
+			alive &= ~(IOU_matrix(btl, bbr, tl[keep], br[keep]) > iou_threshold).any(1)
+		overlaps = IOU_matrix(btl, bbr, btl, bbr) > iou_threshold
+
+		for j in range(stop - start):
+			if not alive[j]:
+				continue
+			keep.append(start + j)
+			if len(keep) > min_count and scores[start + j] < min_threshold:
+				del(keep[-1])
+				return order[keep]
+			if len(keep) == max_count:
+				return order[keep]
+			alive[j + 1:] &= ~overlaps[j, j + 1:]
+
+	return order[keep]
 
 
 def image_files_from_folder(folder,upper=True):
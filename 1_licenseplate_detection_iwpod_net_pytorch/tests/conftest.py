@@ -0,0 +1,8 @@
+import os
+import sys
+
+#
+#  Tests import the scripts (detect.py, ...) and the src package as the scripts do, from the
+#  directory of the project
+#
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
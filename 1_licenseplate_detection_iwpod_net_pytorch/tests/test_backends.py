@@ -0,0 +1,53 @@
+import pytest
+import torch
+
+from export import export_onnx, export_torchscript
+from src.backends import load_backend
+from src.model import IWPODNet
+
+#
+#  Exported models against eager mode, on inputs of other sizes than the export example (height and
+#  width are dynamic) and with batches of several images
+#
+SIZES = [(1, 128, 160), (2, 256, 256), (1, 320, 208)]
+
+
+@pytest.fixture(scope='module')
+def models(tmp_path_factory):
+    torch.manual_seed(0)
+    model = IWPODNet()
+    weights = str(tmp_path_factory.mktemp('weights') / 'iwpodnet.pth')
+    torch.save({'model_state_dict': model.state_dict()}, weights)
+    model.eval().fuse()
+    return model, weights, tmp_path_factory.mktemp('exported')
+
+
+def assert_matches_eager(backend, eager):
+    for b, h, w in SIZES:
+        inputs = torch.rand((b, 3, h, w), generator=torch.Generator().manual_seed(h))
+        with torch.no_grad():
+            expected = eager(inputs)
+            outputs = backend(inputs.to(backend.device)).cpu()
+        assert outputs.shape == (b, 7, h // 16, w // 16)
+        torch.testing.assert_close(outputs, expected, rtol=1e-4, atol=1e-4)
+
+
+def test_eager_backend(models):
+    model, weights, _ = models
+    assert_matches_eager(load_backend('eager', weights, device='cpu'), model)
+
+
+def test_torchscript_export(models):
+    model, _, folder = models
+    path = str(folder / 'iwpodnet.pt')
+    export_torchscript(model, path)
+    assert_matches_eager(load_backend('torchscript', path, device='cpu'), model)
+
+
+def test_onnx_export(models):
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+    model, _, folder = models
+    path = str(folder / 'iwpodnet.onnx')
+    export_onnx(model, path)
+    assert_matches_eager(load_backend('onnx', path), model)
@@ -0,0 +1,102 @@
+import random
+
+import numpy as np
+import pytest
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from src.checkpoint import load_checkpoint, restore_data_state, rng_state, save_checkpoint
+from src.dataset import ResumableRandomSampler
+
+
+class RandomDataset(Dataset):
+    #
+    #  Samples draw from the generators used by augment_sample, like ALPRDataset
+    #
+    def __len__(self):
+        return 10
+
+    def __getitem__(self, index):
+        return index, np.random.rand(), random.random(), torch.rand(1)
+
+
+def run(path, epochs=3, batch_size=4, save_at=None, resume=False, generator_device='cpu'):
+    #
+    #  Training loop of train.py (without the model), recording the batches from the resumed position
+    #  on: saves a checkpoint after batch save_at = (epoch, batch) of the run (batch 0: at the end of
+    #  the epoch), or resumes from the one at path
+    #
+    random.seed(0)
+    np.random.seed(0)
+    torch.manual_seed(0)
+    dataset = RandomDataset()
+    sampler = ResumableRandomSampler(dataset, seed=0)
+    loader_generator = torch.Generator(device=generator_device)
+    loader_generator.manual_seed(0)
+    loader = DataLoader(dataset, batch_size=batch_size, sampler=sampler, generator=loader_generator)
+
+    epoch_last = batch_last = 0
+    if resume:
+        checkpoint = load_checkpoint(path)
+        epoch_last = checkpoint['epoch'] + 1
+        batch_last = checkpoint['batch']
+        restore_data_state(checkpoint, sampler, loader_generator)
+
+    recording = resume
+    batches = []
+    for epoch in range(epoch_last, epochs):
+        batch_start = batch_last if epoch == epoch_last else 0
+        sampler.set_epoch(epoch, batch_start * batch_size)
+        loader_generator_state = loader_generator.get_state()
+        for i, batch in enumerate(loader, batch_start):
+            if recording:
+                batches.append((epoch, i, batch))
+            if save_at == (epoch, i + 1):
+                save_checkpoint({'epoch': epoch - 1, 'batch': i + 1, 'sampler_state': sampler.state_dict(),
+                                 'loader_generator_state': loader_generator_state, 'rng_state': rng_state()}, path)
+                recording = True
+        epoch_rng_state = rng_state()
+        sampler.set_epoch(epoch + 1)
+        loader_generator_state = loader_generator.get_state()
+        if save_at == (epoch + 1, 0):
+            save_checkpoint({'epoch': epoch, 'batch': 0, 'sampler_state': sampler.state_dict(),
+                             'loader_generator_state': loader_generator_state, 'rng_state': epoch_rng_state}, path)
+            recording = True
+
+    # RNG streams after training
+    streams = (np.random.rand(4), random.random(), torch.rand(4), torch.empty((), dtype=torch.int64).random_(generator=loader_generator))
+    return batches, streams
+
+
+def assert_same_run(expected, resumed):
+    (expected_batches, expected_streams), (batches, streams) = expected, resumed
+    assert len(batches) == len(expected_batches) > 0
+    for (epoch, i, batch), (expected_epoch, expected_i, expected_batch) in zip(batches, expected_batches):
+        assert (epoch, i) == (expected_epoch, expected_i)
+        for values, expected_values in zip(batch, expected_batch):
+            torch.testing.assert_close(values, expected_values, rtol=0, atol=0)
+    np.testing.assert_array_equal(streams[0], expected_streams[0])
+    assert streams[1] == expected_streams[1]
+    torch.testing.assert_close(streams[2], expected_streams[2], rtol=0, atol=0)
+    assert streams[3] == expected_streams[3]
+
+
+@pytest.mark.parametrize('save_at', [(1, 1), (1, 2), (2, 0)])
+def test_resume_reproduces_training(tmp_path, save_at):
+    path = str(tmp_path / 'last.pth')
+    expected = run(path, save_at=save_at)
+    assert_same_run(expected, run(path, resume=True))
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason='requires a GPU')
+def test_resume_with_cuda_generator(tmp_path):
+    #
+    #  train.py draws DataLoader seeds from a generator on the training device
+    #
+    path = str(tmp_path / 'last.pth')
+    torch.set_default_device('cuda')
+    try:
+        expected = run(path, save_at=(1, 1), generator_device='cuda')
+        assert_same_run(expected, run(path, resume=True, generator_device='cuda'))
+    finally:
+        torch.set_default_device('cpu')
@@ -0,0 +1,52 @@
+import json
+
+import cv2
+import numpy as np
+import torch
+
+from detect import detect_directory
+
+
+class FlakyModel:
+    #
+    #  Stand-in for a backend, raising on inputs of a given width (no plates otherwise)
+    #
+    device = torch.device('cpu')
+
+    def __init__(self, failing_width=None):
+        self.failing_width = failing_width
+
+    def eval(self):
+        return self
+
+    def __call__(self, inputs):
+        b, _, h, w = inputs.shape
+        if w == self.failing_width:
+            raise RuntimeError('forward failed')
+        return torch.zeros((b, 7, h // 16, w // 16))
+
+
+def records(path):
+    with open(path) as fp:
+        return {record['image']: record for record in map(json.loads, fp)}
+
+
+def test_failures_do_not_stop_the_run(tmp_path):
+    root = tmp_path / 'images'
+    root.mkdir()
+    for name, width in [('a.jpg', 160), ('b.jpg', 160), ('failing.jpg', 96)]:
+        cv2.imwrite(str(root / name), np.full((64, width, 3), 128, dtype=np.uint8))
+    (root / 'corrupt.jpg').write_bytes(b'not an image')
+    output = str(tmp_path / 'detections.jsonl')
+
+    count, skipped, failed, _ = detect_directory(FlakyModel(failing_width=96), str(root), output, 'fullimage', .5)
+    assert (count, skipped, failed) == (2, 0, 2)
+    result = records(output)
+    assert result[str(root / 'a.jpg')]['plates'] == result[str(root / 'b.jpg')]['plates'] == []
+    assert result[str(root / 'corrupt.jpg')]['error'] == 'unreadable image'
+    assert 'forward failed' in result[str(root / 'failing.jpg')]['error']
+
+    # failed images are tried again on restart
+    count, skipped, failed, _ = detect_directory(FlakyModel(), str(root), output, 'fullimage', .5)
+    assert (count, skipped, failed) == (1, 2, 1)
+    assert records(output)[str(root / 'failing.jpg')]['plates'] == []
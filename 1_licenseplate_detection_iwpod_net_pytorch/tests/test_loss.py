@@ -0,0 +1,52 @@
+import pytest
+import torch
+
+from loss_benchmark import legacy_iwpodnet_loss, legacy_loc_loss, random_maps
+from src.loss import iwpodnet_loss, loc_loss
+
+
+def loss_and_grad(loss_fn, Ytrue, Ypred):
+    Ypred = Ypred.clone().requires_grad_()
+    loss = loss_fn(Ytrue, Ypred)
+    loss.sum().backward()
+    return loss.detach(), Ypred.grad
+
+
+@pytest.mark.parametrize('size', [(1, 13, 13), (8, 13, 13), (3, 30, 40)])
+def test_loc_loss_matches_legacy(size):
+    Ytrue, Ypred = random_maps(*size, seed=sum(size))
+    loss, grad = loss_and_grad(loc_loss, Ytrue, Ypred)
+    expected_loss, expected_grad = loss_and_grad(legacy_loc_loss, Ytrue, Ypred)
+    torch.testing.assert_close(loss, expected_loss, rtol=1e-6, atol=1e-5)
+    torch.testing.assert_close(grad, expected_grad, rtol=1e-6, atol=1e-6)
+
+
+def test_loss_matches_legacy():
+    Ytrue, Ypred = random_maps(4, 13, 13, seed=1)
+    loss, grad = loss_and_grad(iwpodnet_loss, Ytrue, Ypred)
+    expected_loss, expected_grad = loss_and_grad(legacy_iwpodnet_loss, Ytrue, Ypred)
+    torch.testing.assert_close(loss, expected_loss, rtol=1e-6, atol=1e-5)
+    torch.testing.assert_close(grad, expected_grad, rtol=1e-6, atol=1e-6)
+
+
+@pytest.mark.parametrize('autocast', [False, True])
+@pytest.mark.parametrize('dtype', [torch.bfloat16, torch.float16])
+def test_loss_of_half_precision_predictions(dtype, autocast):
+    #
+    #  Mixed precision training (train.py --precision): predictions come from the model in bf16/fp16,
+    #  and the loss is computed in fp32 from them, also when called inside autocast (CPU autocast is
+    #  bf16 only on older PyTorch)
+    #
+    Ytrue, Ypred = random_maps(4, 13, 13, seed=2)
+    Ypred = Ypred.to(dtype)
+
+    def half_loss(Ytrue, Ypred):
+        with torch.autocast(device_type='cpu', dtype=torch.bfloat16, enabled=autocast):
+            return iwpodnet_loss(Ytrue, Ypred)
+
+    loss, grad = loss_and_grad(half_loss, Ytrue, Ypred)
+    expected_loss, expected_grad = loss_and_grad(legacy_iwpodnet_loss, Ytrue, Ypred.float())
+    assert loss.dtype == torch.float32
+    assert grad.dtype == dtype
+    torch.testing.assert_close(loss, expected_loss, rtol=1e-6, atol=1e-5)
+    torch.testing.assert_close(grad, expected_grad.to(dtype))
@@ -0,0 +1,41 @@
+import torch
+import torch.nn as nn
+
+from src.model import IWPODNet
+
+
+def random_model(seed=0):
+    #
+    #  Model with non-trivial BatchNorm statistics and affine parameters
+    #
+    torch.manual_seed(seed)
+    model = IWPODNet()
+    for module in model.modules():
+        if isinstance(module, nn.BatchNorm2d):
+            module.running_mean.uniform_(-.5, .5)
+            module.running_var.uniform_(.5, 2.)
+            module.weight.data.uniform_(.5, 1.5)
+            module.bias.data.uniform_(-.2, .2)
+    return model.eval()
+
+
+def test_fused_model_matches_eval_model():
+    model = random_model()
+    inputs = torch.rand((2, 3, 128, 160))
+    with torch.no_grad():
+        expected = model(inputs)
+        model.fuse()
+        outputs = model(inputs)
+    assert not any(isinstance(module, nn.BatchNorm2d) for module in model.modules())
+    torch.testing.assert_close(outputs, expected, rtol=1e-4, atol=1e-4)
+
+
+def test_fuse_twice():
+    model = random_model()
+    inputs = torch.rand((1, 3, 64, 64))
+    with torch.no_grad():
+        fused = model.fuse()(inputs)
+        state = {name: value.clone() for name, value in model.state_dict().items()}
+        refused = model.fuse()(inputs)
+    assert all(torch.equal(value, state[name]) for name, value in model.state_dict().items())
+    torch.testing.assert_close(refused, fused, rtol=0, atol=0)
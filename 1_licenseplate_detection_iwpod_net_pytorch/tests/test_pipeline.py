@@ -0,0 +1,37 @@
+import pytest
+
+from src.pipeline import Failure, Pipeline, Stage
+
+
+def double(x):
+    return 2 * x
+
+
+def fail_on_3(x):
+    if x == 6:
+        raise ValueError('bad item')
+    return x + 1
+
+
+def make_pipeline():
+    return Pipeline([Stage('double', double, 2), Stage('check', fail_on_3, 2), Stage('double again', double, 1)], queue_size=2)
+
+
+def test_outputs():
+    outputs = Pipeline([Stage('double', double, 3), Stage('double again', double, 2)], queue_size=2).run(range(50))
+    assert sorted(outputs) == [4 * x for x in range(50)]
+
+
+def test_failure_is_raised():
+    with pytest.raises(ValueError, match='bad item'):
+        list(make_pipeline().run(range(10)))
+
+
+def test_failure_does_not_stop_the_other_items():
+    outputs = list(make_pipeline().run(range(10), yield_failures=True))
+    failures = [output for output in outputs if isinstance(output, Failure)]
+    assert len(failures) == 1
+    assert failures[0].item == 3  # input item, not the input of the stage that failed
+    assert failures[0].stage == 'check'
+    assert isinstance(failures[0].exception, ValueError)
+    assert sorted(output for output in outputs if not isinstance(output, Failure)) == [2 * (2 * x + 1) for x in range(10) if x != 3]
@@ -0,0 +1,144 @@
+import cv2
+import numpy as np
+import pytest
+
+from src.label import Label
+from src.sampler import GetCentroid, ShrinkQuadrilateral, insidePolygon, labels2output_map, project_all
+
+
+def legacy_line_polygon_edges(pts):
+    lines = []
+    for i in range(4):
+        x1 = np.hstack((pts[:, i], 1))
+        x2 = np.hstack((pts[:, (i + 1) % 4], 1))
+        lines.append(np.cross(x1, x2))
+    return lines
+
+
+def legacy_labels2output_map(labelist, lpptslist, dim, stride, alpha=0.75):
+    #
+    #  Reference: the cell by cell implementation labels2output_map replaced
+    #
+    dim0 = 208
+    side = ((float(dim0) + 40.) / 2.) / stride
+    outsize = int(dim / stride)
+    Y = np.zeros((outsize, outsize, 2 * 4 + 1), dtype='float32')
+    MN = np.array([outsize, outsize])
+    WH = np.array([dim, dim], dtype=float)
+
+    for lppts, label in zip(lpptslist, labelist):
+        tlx, tly = np.floor(np.maximum(label.tl(), 0.) * MN).astype(int).tolist()
+        brx, bry = np.ceil(np.minimum(label.br(), 1.) * MN).astype(int).tolist()
+        p_MN = lppts * WH.reshape((2, 1)) / stride
+        lines = legacy_line_polygon_edges((ShrinkQuadrilateral(lppts, alpha).T * MN).T)
+        for x in range(tlx, brx):
+            for y in range(tly, bry):
+                mn = np.array([float(x) + .5, float(y) + .5])
+                if insidePolygon(mn, lines):
+                    p_side = (p_MN - mn.reshape((2, 1))) / side
+                    Y[y, x, 0] = 1.
+                    Y[y, x, 1:] = p_side.T.flatten()
+        if (max(lppts[0,]) - min(lppts[0,]) > .01 and max(lppts[1,]) - min(lppts[1,]) > .01):
+            cc = np.array(np.round(GetCentroid(p_MN) - 0.5), np.int8)
+            x = max(0, min(cc[0], outsize - 1))
+            y = max(0, min(cc[1], outsize - 1))
+            mn = np.array([float(x) + .5, float(y) + .5])
+            p_side = (p_MN - mn.reshape((2, 1))) / side
+            Y[y, x, 0] = 1.
+            Y[y, x, 1:] = p_side.T.flatten()
+    return Y
+
+
+def random_quad(rng, center_range=(0., 1.)):
+    #
+    #  Clockwise quadrilateral (relative coordinates): a rotated rectangle with jittered corners
+    #
+    center = rng.uniform(*center_range, size=2)
+    w, h = rng.uniform(.05, .6), rng.uniform(.02, .3)
+    angle = rng.uniform(-.6, .6)
+    corners = np.array([[-w, w, w, -w], [-h, -h, h, h]]) / 2 + rng.normal(0, .01, (2, 4))
+    R = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    return R @ corners + center.reshape((2, 1))
+
+
+def labels_for(ptslist):
+    return [Label(0, pts.min(1), pts.max(1)) for pts in ptslist]
+
+
+def assert_same_map(ptslist, dim=208, stride=16, alpha=.75):
+    expected = legacy_labels2output_map(labels_for(ptslist), ptslist, dim, stride, alpha)
+    Y = labels2output_map(labels_for(ptslist), ptslist, dim, stride, alpha)
+    np.testing.assert_array_equal(Y, expected)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_plates(seed):
+    rng = np.random.RandomState(seed)
+    for _ in range(25):
+        assert_same_map([random_quad(rng) for _ in range(rng.randint(1, 4))])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_plates_at_the_border(seed):
+    #
+    #  Plates centered near (or beyond) the image border, partly outside the output map
+    #
+    rng = np.random.RandomState(100 + seed)
+    for _ in range(25):
+        assert_same_map([random_quad(rng, (-.15, .15)), random_quad(rng, (.85, 1.15))])
+
+
+@pytest.mark.parametrize('dim', [208, 256, 320])
+def test_other_input_sizes(dim):
+    rng = np.random.RandomState(dim)
+    for _ in range(10):
+        assert_same_map([random_quad(rng)], dim=dim)
+
+
+def test_degenerate_plates():
+    fake = np.array([[0.5, 0.5001, 0.5001, 0.5], [0.5, 0.5, 0.5001, 0.5001]])  # images without plates
+    point = np.full((2, 4), .3)
+    collinear = np.array([[.1, .4, .7, .9], [.2, .2, .2, .2]])
+    vertical = np.array([[.6, .6, .6, .6], [.1, .3, .5, .8]])
+    tiny = np.array([[.2, .205, .205, .2], [.2, .2, .205, .205]])
+    for pts in [fake, point, collinear, vertical, tiny]:
+        assert_same_map([pts])
+    assert_same_map([fake, collinear, random_quad(np.random.RandomState(0))])
+
+
+class FixedBackground:
+    #
+    #  Background pool always returning the same crop
+    #
+    def __init__(self, dim):
+        self.crop = np.random.RandomState(1).randint(0, 256, (dim, dim, 3)).astype(np.uint8)
+
+    def __len__(self):
+        return 1
+
+    def random_crop(self, width, height, dtype='float32'):
+        return self.crop.copy()
+
+
+@pytest.mark.parametrize('negate', [False, True])
+@pytest.mark.parametrize('background', [True, False])
+def test_blur_keeps_background_sharp(negate, background):
+    #
+    #  roi_first blurs the warped image in project_all: as in the original path (blurred source image),
+    #  background pixels are the same with and without blur
+    #
+    dim = 208
+    I = np.random.RandomState(0).randint(0, 256, (120, 160, 3)).astype(np.uint8)
+    T = np.array([[.6, .1, 40.], [-.05, .7, 50.], [1e-4, 2e-4, 1.]])  # I maps to a quadrilateral inside the ROI
+    bgpool = FixedBackground(dim) if background else []
+    sharp, _ = project_all(I, T, [], dim, bgpool, negate=negate)
+    blurred, _ = project_all(I, T, [], dim, bgpool, negate=negate, blur_sigma=2.)
+
+    corners = cv2.perspectiveTransform(np.array([[[0, 0], [160, 0], [160, 120], [0, 120]]], dtype=np.float64), T)
+    inside = np.zeros((dim, dim), dtype=np.uint8)
+    cv2.fillConvexPoly(inside, np.round(corners[0]).astype(np.int32), 1)
+    outside = cv2.dilate(inside, np.ones((5, 5), dtype=np.uint8)) == 0
+    inside = cv2.erode(inside, np.ones((5, 5), dtype=np.uint8)) > 0
+
+    np.testing.assert_array_equal(blurred[outside], sharp[outside])
+    assert np.abs(blurred[inside].astype(float) - sharp[inside]).mean() > 5
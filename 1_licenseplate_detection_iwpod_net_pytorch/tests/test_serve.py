@@ -0,0 +1,94 @@
+import http.client
+import json
+import threading
+
+import cv2
+import numpy as np
+import pytest
+import torch
+
+from serve import make_process_batch, make_server
+from src.backends import load_backend
+from src.model import IWPODNet
+
+
+@pytest.fixture(scope='module')
+def backend(tmp_path_factory):
+    torch.manual_seed(0)
+    weights = str(tmp_path_factory.mktemp('weights') / 'iwpodnet.pth')
+    torch.save({'model_state_dict': IWPODNet().state_dict()}, weights)
+    return load_backend('eager', weights, device='cpu')
+
+
+@pytest.fixture(scope='module')
+def server(backend, tmp_path_factory):
+    image_root = tmp_path_factory.mktemp('images')
+    cv2.imwrite(str(image_root / 'car.jpg'), np.full((120, 160, 3), 128, dtype=np.uint8))
+    cv2.imwrite(str(image_root.parent / 'outside.jpg'), np.full((120, 160, 3), 128, dtype=np.uint8))
+    server = make_server(backend, 'eager', port=0, threshold=.9, image_root=str(image_root))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, body, content_type='application/json', query=''):
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=60)
+    connection.request('POST', '/detect' + query, body=body, headers={'Content-Type': content_type})
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def jpeg(w=160, h=120):
+    return cv2.imencode('.jpg', np.full((h, w, 3), 128, dtype=np.uint8))[1].tobytes()
+
+
+def test_image_bytes(server):
+    status, result = post(server, jpeg(), 'application/octet-stream')
+    assert status == 200
+    assert result['batch_size'] == 1 and isinstance(result['plates'], list)
+
+
+@pytest.mark.parametrize('body', [b'{"path": ', b'[1, 2]', b'{"threshold": 0.5}'])
+def test_invalid_json(server, body):
+    status, result = post(server, body)
+    assert status == 400 and 'error' in result
+
+
+@pytest.mark.parametrize('query', ['?threshold=abc', '?threshold=nan'])
+def test_invalid_threshold(server, query):
+    status, _ = post(server, jpeg(), 'application/octet-stream', query)
+    assert status == 400
+    status, _ = post(server, json.dumps({'path': 'car.jpg', 'threshold': [1]}))
+    assert status == 400
+
+
+def test_paths_under_the_image_root(server):
+    status, _ = post(server, json.dumps({'path': 'car.jpg'}))
+    assert status == 200
+    status, _ = post(server, json.dumps({'path': server.image_root + '/car.jpg'}))
+    assert status == 200
+    for path in ['../outside.jpg', server.image_root + '/../outside.jpg', '/etc/passwd']:
+        status, result = post(server, json.dumps({'path': path}))
+        assert status == 403, path
+
+
+def test_paths_disabled_without_image_root(server):
+    image_root, server.image_root = server.image_root, None
+    try:
+        status, _ = post(server, json.dumps({'path': 'car.jpg'}))
+    finally:
+        server.image_root = image_root
+    assert status == 403
+
+
+def test_forward_batch_sizes(backend):
+    #
+    #  Inputs of 240 and 256 pixels share the 256 pixel bucket, inputs of 480 pixels do not
+    #
+    process_batch = make_process_batch(backend, bucket_step=64)
+    items = [{'image': np.zeros((h, w, 3), dtype=np.float32), 'vtype': 'fullimage', 'threshold': .9, 'crops': False}
+             for w, h in [(240, 240), (256, 256), (480, 240)]]
+    results = process_batch(items)
+    assert [result['batch_size'] for result in results] == [2, 2, 1]
@@ -1,12 +1,17 @@
 import os
+import time
+import random
 import argparse
 
+import numpy as np
 import torch
 import torch.optim as optim
 from torch.utils.data import DataLoader
 
 from src.model import IWPODNet
-from src.dataset import ALPRDataset
+from src.dataset import ALPRDataset, ResumableRandomSampler, seed_worker
+from src.checkpoint import rng_state, restore_data_state, save_checkpoint, load_checkpoint
+from src.sampler import BackgroundPool
 from src.loss import iwpodnet_loss
 
 
@@ -16,11 +21,25 @@ if __name__ == '__main__':
     parser.add_argument('-md', '--model-dir', type=str, default='weights', help='Directory containing models and weights')
     parser.add_argument('-cm', '--cur_model', type=str, default='fake_name', help='Pre-trained model')
     parser.add_argument('-n', '--name', type=str, default='iwpodnet_retrained', help='Output model name')
-    parser.add_argument('-tr', '--train-dir', type=str, default='train_dir', help='Input data directory for training')
+    parser.add_argument('-tr', '--train-dir', type=str, default='train_dir', help='Input data directory (or shard created with pack_shard.py) for training')
     parser.add_argument('-e', '--epochs', type=int, default=10000, help='Number of epochs (default = 1,500)')
     parser.add_argument('-bs', '--batch-size', type=int, default=32, help='Mini-batch size (default = 64)')
     parser.add_argument('-lr', '--learning-rate', type=float, default=0.001, help='Learning rate (default = 0.001)')
     parser.add_argument('-se', '--save-epochs', type=int, default=2000, help='Freqnecy for saving checkpoints (in epochs) ')
+    parser.add_argument('--lazy', action='store_true', help='Decode training images on demand instead of loading all of them at startup')
+    parser.add_argument('--cache-mb', type=float, default=0, help='Size (in MB) of the decoded image cache used with --lazy (default = 0, no cache)')
+    parser.add_argument('-w', '--workers', type=int, default=0, help='Number of data loading worker processes (default = 0, loads in the training process)')
+    parser.add_argument('--pin-memory', action='store_true', help='Loads batches into pinned memory for faster host to GPU copies')
+    parser.add_argument('--prefetch-factor', type=int, default=2, help='Batches prefetched by each worker (default = 2)')
+    parser.add_argument('--persistent-workers', action='store_true', help='Keeps worker processes alive between epochs')
+    parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'bf16', 'fp16'], help='Precision of the forward pass (autocast; fp16 on GPU only); the loss is always computed in fp32')
+    parser.add_argument('--channels-last', action='store_true', help='Uses the channels-last (NHWC) memory format for the model and inputs')
+    parser.add_argument('--bg-dir', type=str, default='bgimages', help='Directory with background images used in data augmentation')
+    parser.add_argument('--augment', type=str, default='legacy', choices=['legacy', 'roi'], help='Augmentation path: legacy (full resolution float) or roi (warps uint8 images first, photometric transforms on the ROI only)')
+    parser.add_argument('--bg-mmap', type=str, default=None, help='File caching the background images, memory-mapped and shared by all workers (delete it to rebuild)')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed (default = random, printed at startup)')
+    parser.add_argument('--resume', type=str, default=None, help='Checkpoint to resume from (model, optimizer, RNG states and position in the epoch)')
+    parser.add_argument('--checkpoint-minutes', type=float, default=30, help='Minutes between checkpoints saved to <model-dir>/<name>_last.pth (default = 30, 0 disables)')
     args = parser.parse_args()
 
     MaxEpochs = args.epochs
@@ -34,6 +53,12 @@ if __name__ == '__main__':
 
     modelname = '%s/%s' % (modeldir, args.cur_model)
 
+    seed = args.seed if args.seed is not None else int.from_bytes(os.urandom(4), 'little')
+    print('Random seed: %d' % seed)
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
     dim = 208
     mymodel = IWPODNet()
     opt = optim.Adam(mymodel.parameters(), lr=learning_rate)
@@ -42,48 +67,128 @@ if __name__ == '__main__':
         os.makedirs(modeldir)
 
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    if args.precision == 'fp16' and device.type != 'cuda':
+        # no fp16 autocast (and no gradient scaling) on CPU with older PyTorch, and very slow convolutions otherwise
+        parser.error('--precision fp16 requires a GPU, use bf16 on CPU')
     torch.set_default_device(device)
 
     print('Loading training data...')
 
-    train_dataset = ALPRDataset(train_dir, dim=dim)
-    train_loader = DataLoader(train_dataset,batch_size=batch_size,shuffle=True,generator=torch.Generator(device=device))
+    bgpool = BackgroundPool(args.bg_dir, mmap_path=args.bg_mmap).load()  # loaded before workers start, so that they share it
+    print('%d background images loaded' % len(bgpool))
+    train_dataset = ALPRDataset(train_dir, dim=dim, lazy=args.lazy, cache_mb=args.cache_mb, bgpool=bgpool,
+                                roi_first=args.augment == 'roi')
+    loader_args = {}
+    if args.workers > 0:
+        loader_args = {'prefetch_factor': args.prefetch_factor, 'persistent_workers': args.persistent_workers}
+    train_sampler = ResumableRandomSampler(train_dataset, seed=seed)
+    loader_generator = torch.Generator(device=device)  # draws the seeds of DataLoader workers
+    loader_generator.manual_seed(seed)
+    train_loader = DataLoader(train_dataset,batch_size=batch_size,sampler=train_sampler,generator=loader_generator,
+                              num_workers=args.workers, pin_memory=args.pin_memory, worker_init_fn=seed_worker, **loader_args)
 
     mymodel.train()
     mymodel.to(device)
 
+    #
+    #  Mixed precision and memory format. Gradients are scaled when training in fp16
+    #
+    memory_format = torch.channels_last if args.channels_last else torch.contiguous_format
+    mymodel.to(memory_format=memory_format)
+    amp_dtype = {'bf16': torch.bfloat16, 'fp16': torch.float16}.get(args.precision, torch.float32)
+    use_amp = args.precision != 'fp32'
+    use_scaler = args.precision == 'fp16'
+    if hasattr(torch.amp, 'GradScaler'):
+        scaler = torch.amp.GradScaler(device.type, enabled=use_scaler)
+    else:
+        scaler = torch.cuda.amp.GradScaler(enabled=use_scaler and device.type == 'cuda')
+
+    #
+    #  Resumes training. 'epoch' is the last completed epoch, and 'batch' the number of batches already
+    #  done in the next one. RNG states are exactly restored when loading data in the training process
+    #  (--workers 0); with workers, the data order and the seeds of workers in each epoch are restored
+    #
     epoch_last = 0
-    # checkpoint = torch.load('./weights/iwpodnet_retrained_epoch12000.pth')
-    # mymodel.load_state_dict(checkpoint['model_state_dict'])
-    # opt.load_state_dict(checkpoint['optimizer_state_dict'])
-    # epoch_last = checkpoint['epoch'] + 1
+    batch_last = 0
+    cost_last = 0.0
+    if args.resume is not None:
+        checkpoint = load_checkpoint(args.resume)
+        mymodel.load_state_dict(checkpoint['model_state_dict'])
+        opt.load_state_dict(checkpoint['optimizer_state_dict'])
+        epoch_last = checkpoint['epoch'] + 1
+        if 'batch' in checkpoint:
+            batch_last = checkpoint['batch']
+            cost_last = checkpoint['batch_cost']
+            scaler.load_state_dict(checkpoint['scaler_state_dict'])
+            restore_data_state(checkpoint, train_sampler, loader_generator)
+        print('Resuming from %s (epoch %d, batch %d)' % (args.resume, epoch_last + 1, batch_last))
+
+    def make_checkpoint(epoch, batch, batch_cost, cost):
+        return {
+            'epoch': epoch,
+            'batch': batch,
+            'batch_cost': batch_cost,
+            'model_state_dict': mymodel.state_dict(),
+            'optimizer_state_dict': opt.state_dict(),
+            'scaler_state_dict': scaler.state_dict(),
+            'sampler_state': train_sampler.state_dict(),
+            'loader_generator_state': loader_generator_state,
+            'rng_state': epoch_rng_state if batch == 0 else rng_state(),
+            'cost': cost
+        }
+
+    model_path_last = os.path.join(modeldir, netname + '_last.pth')
+    last_checkpoint = time.time()
 
     for epoch in range(epoch_last,MaxEpochs):
-        cost = 0.0
-
-        for i, (inputs, labels) in enumerate(train_loader):
-            inputs, labels = inputs.to(device), labels.to(device)
+        batch_start = batch_last if epoch == epoch_last else 0
+        cost = cost_last if epoch == epoch_last else 0.0
+        samples = 0
+        data_time = 0.0
+        start = time.time()
+        data_start = start
+
+        #
+        #  States at the start of the epoch (the DataLoader draws the seeds of its workers from its generator)
+        #
+        train_sampler.set_epoch(epoch, batch_start * batch_size)
+        loader_generator_state = loader_generator.get_state()
+
+        for i, (inputs, labels) in enumerate(train_loader, batch_start):
+            data_time += time.time() - data_start
+            inputs = inputs.to(device, non_blocking=args.pin_memory, memory_format=memory_format)
+            labels = labels.to(device, non_blocking=args.pin_memory)
+            samples += inputs.size(0)
 
             opt.zero_grad()
 
-            outputs = mymodel(inputs)
+            with torch.autocast(device_type=device.type, dtype=amp_dtype, enabled=use_amp):
+                outputs = mymodel(inputs)
             loss = iwpodnet_loss(labels, outputs)
-            loss.mean().backward()
-            opt.step()
+            scaler.scale(loss.mean()).backward()
+            scaler.step(opt)
+            scaler.update()
 
             cost += loss.mean().item()
 
-        cost = cost / len(train_loader)
-        print(f"Epoch {epoch + 1}/{MaxEpochs} Loss: {cost:.4f}")
-
+            #
+            #  Periodic checkpoint, restarting at the next batch of this epoch
+            #
+            if args.checkpoint_minutes > 0 and time.time() - last_checkpoint > 60 * args.checkpoint_minutes:
+                save_checkpoint(make_checkpoint(epoch - 1, i + 1, cost, cost / (i + 1)), model_path_last)
+                last_checkpoint = time.time()
+            data_start = time.time()
+
+        elapsed = time.time() - start
+        cost = cost / (batch_start + len(train_loader))
+        epoch_rng_state = rng_state()
+        train_sampler.set_epoch(epoch + 1)
+        print(f"Epoch {epoch + 1}/{MaxEpochs} Loss: {cost:.4f} ({samples / elapsed:.1f} samples/s, {100 * data_time / elapsed:.0f}% waiting for data)")
+
+        loader_generator_state = loader_generator.get_state()
         if (epoch + 1) % save_epochs == 0:
             model_path_ckpt = os.path.join(modeldir, netname + '_epoch%d' % (epoch + 1))
-            torch.save({
-                'epoch': epoch,
-                'model_state_dict': mymodel.state_dict(),
-                'optimizer_state_dict': opt.state_dict(),
-                'cost': cost
-            }, model_path_ckpt + '.pth')
+            save_checkpoint(make_checkpoint(epoch, 0, 0.0, cost), model_path_ckpt + '.pth')
 
     print('Finished training the model')
 
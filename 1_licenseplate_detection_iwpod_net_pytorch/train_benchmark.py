@@ -0,0 +1,231 @@
+import argparse
+import json
+import random
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+import torch.optim as optim
+from torch.utils.data import DataLoader
+
+import src.dataset
+import src.sampler
+from src.model import IWPODNet
+from src.dataset import ALPRDataset, seed_worker
+from src.sampler import BackgroundPool
+from src.loss import iwpodnet_loss
+from src.profiling import StageTimer
+
+#
+#  Training throughput benchmark: samples/s of the data pipeline alone (with the time of each step of
+#  augment_sample), of the model step alone on a fixed batch, and of both together as in train.py,
+#  to find out which of them bounds training. The defaults run on CPU in less than a minute
+#
+
+#
+#  Functions timed inside augment_sample (names in src.sampler). project_all includes the warp and the
+#  background crop, which is also timed on its own (bg_random_crop)
+#
+AUGMENT_FUNCTIONS = ['im2single', 'randomblur', 'find_T_matrix', 'perspective_transform', 'project_all', 'random_crop',
+                     'hsv_transform']
+
+
+@contextmanager
+def instrumented(timer, bgpool):
+    #
+    #  Times the calls of augment_sample, labels2output_map and the functions of AUGMENT_FUNCTIONS by
+    #  replacing them in the modules calling them (in this process only)
+    #
+    patches = [(src.dataset, 'augment_sample', 'augment_sample'), (src.dataset, 'labels2output_map', 'labels2output_map')]
+    patches += [(src.sampler, name, name) for name in AUGMENT_FUNCTIONS]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    for module, name, stage in patches:
+        setattr(module, name, timer.wrap(stage, getattr(module, name)))
+    bgpool.random_crop = timer.wrap('bg_random_crop', bgpool.random_crop)
+    try:
+        yield
+    finally:
+        for module, name, fn in originals:
+            setattr(module, name, fn)
+        del bgpool.random_crop
+
+
+def sync(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+
+def dataset_alone(dataset, bgpool, samples):
+    #
+    #  Samples/s of the dataset in this process, and time of each step of __getitem__
+    #
+    timer = StageTimer()
+    indices = np.random.randint(0, len(dataset), samples)
+    with instrumented(timer, bgpool):
+        start = time.perf_counter()
+        for index in indices:
+            with timer.stage('getitem'):
+                dataset[index]
+        elapsed = time.perf_counter() - start
+    return samples / elapsed, elapsed, timer
+
+
+def loader_alone(loader, batches):
+    start = time.perf_counter()
+    samples = 0
+    for i, (inputs, _) in enumerate(loader):
+        samples += inputs.size(0)
+        if i + 1 == batches:
+            break
+    return samples / (time.perf_counter() - start)
+
+
+class TrainStep:
+    #
+    #  Optimization step of train.py, timing forward, loss, backward and optimizer
+    #
+    def __init__(self, device, learning_rate=0.001, precision='fp32', channels_last=False):
+        self.device = device
+        self.model = IWPODNet().to(device)
+        self.model.train()
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        self.model.to(memory_format=self.memory_format)
+        self.opt = optim.Adam(self.model.parameters(), lr=learning_rate)
+        self.amp_dtype = {'bf16': torch.bfloat16, 'fp16': torch.float16}.get(precision, torch.float32)
+        self.use_amp = precision != 'fp32'
+        if hasattr(torch.amp, 'GradScaler'):
+            self.scaler = torch.amp.GradScaler(device.type, enabled=precision == 'fp16')
+        else:
+            self.scaler = torch.cuda.amp.GradScaler(enabled=precision == 'fp16' and device.type == 'cuda')
+
+    def __call__(self, inputs, labels, timer):
+        inputs = inputs.to(self.device, memory_format=self.memory_format)
+        labels = labels.to(self.device)
+        self.opt.zero_grad()
+        with timer.stage('forward'):
+            with torch.autocast(device_type=self.device.type, dtype=self.amp_dtype, enabled=self.use_amp):
+                outputs = self.model(inputs)
+            sync(self.device)
+        with timer.stage('loss'):
+            loss = iwpodnet_loss(labels, outputs).mean()
+            sync(self.device)
+        with timer.stage('backward'):
+            self.scaler.scale(loss).backward()
+            sync(self.device)
+        with timer.stage('optimizer'):
+            self.scaler.step(self.opt)
+            self.scaler.update()
+            sync(self.device)
+        return loss.item()
+
+
+def model_alone(step, inputs, labels, steps):
+    #
+    #  Samples/s of the model step on a fixed batch (no data loading), after a warm-up step
+    #
+    step(inputs, labels, StageTimer())
+    timer = StageTimer()
+    start = time.perf_counter()
+    for _ in range(steps):
+        step(inputs, labels, timer)
+    elapsed = time.perf_counter() - start
+    return steps * inputs.size(0) / elapsed, elapsed, timer
+
+
+def end_to_end(step, loader, steps):
+    #
+    #  Samples/s of the training loop of train.py, and the fraction of time waiting for data
+    #
+    timer = StageTimer()
+    samples = 0
+    start = time.perf_counter()
+    data_start = start
+    for i, (inputs, labels) in enumerate(loader):
+        timer.add('data', time.perf_counter() - data_start)
+        step(inputs, labels, timer)
+        samples += inputs.size(0)
+        if i + 1 == steps:
+            break
+        data_start = time.perf_counter()
+    elapsed = time.perf_counter() - start
+    return samples / elapsed, elapsed, timer
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-tr', '--train-dir', type=str, default='train_dir', help='Input data directory (or shard created with pack_shard.py)')
+    parser.add_argument('--bg-dir', type=str, default='bgimages', help='Directory with background images used in data augmentation')
+    parser.add_argument('--augment', type=str, default='legacy', choices=['legacy', 'roi'], help='Augmentation path (see train.py)')
+    parser.add_argument('--lazy', action='store_true', help='Decode training images on demand instead of loading all of them at startup')
+    parser.add_argument('-bs', '--batch-size', type=int, default=16, help='Mini-batch size')
+    parser.add_argument('--samples', type=int, default=256, help='Samples drawn from the dataset alone')
+    parser.add_argument('--steps', type=int, default=4, help='Training steps of the model alone and end-to-end benchmarks')
+    parser.add_argument('-w', '--workers', type=int, default=0, help='Data loading worker processes (default = 0, loads in the training process)')
+    parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'bf16', 'fp16'], help='Precision of the forward pass (autocast; fp16 on GPU only)')
+    parser.add_argument('--channels-last', action='store_true', help='Uses the channels-last (NHWC) memory format for the model and inputs')
+    parser.add_argument('-j', '--threads', type=int, default=None, help='PyTorch threads (default = PyTorch default)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Also writes the results to this file (JSON)')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    if args.precision == 'fp16' and device.type != 'cuda':
+        parser.error('--precision fp16 requires a GPU, use bf16 on CPU')
+    dim = 208
+
+    bgpool = BackgroundPool(args.bg_dir).load()
+    dataset = ALPRDataset(args.train_dir, dim=dim, lazy=args.lazy, bgpool=bgpool, roi_first=args.augment == 'roi')
+    loader_args = {'prefetch_factor': 2, 'persistent_workers': True} if args.workers > 0 else {}
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=True, num_workers=args.workers, worker_init_fn=seed_worker,
+                        drop_last=True, **loader_args)
+    print('%d samples, batch size %d, %d workers, %s, %d threads\n' % (len(dataset), args.batch_size, args.workers, device,
+                                                                      torch.get_num_threads()))
+
+    #
+    #  Data pipeline alone. Shares of the total are not exclusive: bg_random_crop runs inside
+    #  project_all, and all functions run inside augment_sample, itself inside getitem
+    #
+    dataset_rate, dataset_time, dataset_timer = dataset_alone(dataset, bgpool, args.samples)
+    print('Dataset alone: %.1f samples/s (%d samples in %.2f s)' % (dataset_rate, args.samples, dataset_time))
+    print(dataset_timer.report(dataset_time))
+    loader_rate = None
+    if args.workers > 0:
+        loader_rate = loader_alone(loader, max(1, args.samples // args.batch_size))
+        print('DataLoader with %d workers: %.1f samples/s' % (args.workers, loader_rate))
+
+    #
+    #  Model step alone, on a fixed batch standing in for the data pipeline
+    #
+    inputs, labels = next(iter(DataLoader(dataset, batch_size=args.batch_size, shuffle=True)))
+    step = TrainStep(device, precision=args.precision, channels_last=args.channels_last)
+    model_rate, model_time, model_timer = model_alone(step, inputs, labels, args.steps)
+    print('\nModel step alone: %.1f samples/s (%d steps in %.2f s)' % (model_rate, args.steps, model_time))
+    print(model_timer.report(model_time))
+
+    #
+    #  Both together, as in train.py
+    #
+    rate, elapsed, timer = end_to_end(step, loader, args.steps)
+    data_share = sum(timer.times['data']) / elapsed
+    print('\nEnd-to-end: %.1f samples/s (%.0f%% waiting for data)' % (rate, 100 * data_share))
+    print(timer.report(elapsed))
+
+    data_rate = loader_rate if loader_rate is not None else dataset_rate
+    print('\nTraining is bound by the %s (data pipeline %.1f samples/s, model step %.1f samples/s)' % (
+        'data pipeline' if data_rate < model_rate else 'model step', data_rate, model_rate))
+
+    if args.output is not None:
+        results = {'config': vars(args), 'device': str(device), 'threads': torch.get_num_threads(), 'torch': torch.__version__,
+                   'dataset_samples_per_sec': dataset_rate, 'loader_samples_per_sec': loader_rate,
+                   'model_samples_per_sec': model_rate, 'end_to_end_samples_per_sec': rate, 'data_wait_share': data_share,
+                   'dataset_stages': dataset_timer.summary(), 'model_stages': model_timer.summary(),
+                   'end_to_end_stages': timer.summary()}
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=1, sort_keys=True)